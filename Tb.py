@@ -5,14 +5,18 @@ from datetime import datetime
 from dotenv import load_dotenv
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from pyrogram.errors import RPCError, MessageNotModified
 from urllib.parse import urlparse
-import requests
+import http_client
+import media_probe
+import resolvers
+import sniff
+import thumbnails
+from progress import ProgressReporter
+from metadata_cache import share_id
+from file_id_cache import FileIdCache
+from job_queue import FairScheduler, DOWNLOAD_WORKERS, UPLOAD_WORKERS
 import humanize
 from functools import partial
-import mimetypes
-import subprocess
-from PIL import Image
 
 # Load environment variables
 load_dotenv()
@@ -29,11 +33,16 @@ API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 LOG_CHANNEL = int(os.getenv("LOG_CHANNEL"))
-API_BASE_URL = "https://teraboxredirect1.nkweb.workers.dev/?url="
-THUMBNAIL_DIR = "thumbnails"
 
-# Video extensions
-VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov', '.avi', '.wmv', '.flv', '.3gp'}
+# Share links go to the redirect worker or whichever TeraBox API answers first
+link_resolver = resolvers.terabox_resolver(include_redirects=True)
+
+# Telegram file_ids of files already uploaded, so repeats cost no transfer
+file_id_cache = FileIdCache()
+
+# Shared job slots, handed out round-robin between users
+download_slots = FairScheduler(DOWNLOAD_WORKERS)
+upload_slots = FairScheduler(UPLOAD_WORKERS)
 
 # Initialize Pyrogram client
 app = Client(
@@ -48,184 +57,126 @@ def is_valid_terabox_url(url: str) -> bool:
     parsed = urlparse(url)
     return parsed.netloc.endswith(("terabox.com", "teraboxapp.com", "1024terabox.com"))
 
-def generate_thumbnail(video_path: str) -> str:
-    """Generate thumbnail from video using ffmpeg"""
-    try:
-        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
-        thumbnail_path = os.path.join(THUMBNAIL_DIR, f"thumb_{os.path.basename(video_path)}.jpg")
-        
-        # Use ffmpeg to extract thumbnail at 5 seconds
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', '00:00:05',
-            '-vframes', '1',
-            '-q:v', '2',
-            thumbnail_path
-        ]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Resize thumbnail to Telegram requirements
-        with Image.open(thumbnail_path) as img:
-            img.thumbnail((320, 320))
-            img.save(thumbnail_path, "JPEG")
-            
-        return thumbnail_path
-    except Exception as e:
-        logger.error(f"Thumbnail generation failed: {e}")
-        return None
+def render_progress(title: str, current: int, total: int, speed: float, eta: float) -> str:
+    """Build the progress text for a transfer"""
+    percent = (current / total) * 100 if total else 0
+    return (
+        f"{title}\n"
+        f"⏳ {percent:.1f}% of {humanize.naturalsize(total)}\n"
+        f"🚀 {humanize.naturalsize(speed)}/s\n"
+        f"🕒 ETA: {humanize.naturaldelta(eta)}"
+    )
 
-def is_video_file(file_path: str) -> bool:
-    """Check if file is video by extension and MIME type"""
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext in VIDEO_EXTENSIONS:
-        return True
-    
-    mime_type, _ = mimetypes.guess_type(file_path)
-    return mime_type and mime_type.startswith('video/')
+async def download_file(url: str, message: Message) -> str:
+    """Download file with progress tracking without blocking the event loop.
 
-def download_file(url: str, message: Message) -> str:
-    """Download file with progress tracking"""
+    Each job gets its own directory, keyed by its status message, so
+    concurrent jobs for the same share or file name never share a file.
+    """
+    file_path = None
     try:
-        start_time = time.time()
-        last_update = start_time
         downloaded = 0
         
-        # Get filename from URL or headers
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        # Try to get filename from Content-Disposition
-        filename = None
-        if 'content-disposition' in response.headers:
-            cd = response.headers['content-disposition']
-            if 'filename=' in cd:
-                filename = cd.split('filename=')[1].strip('"\'')
-        
-        # Fallback to URL filename
-        if not filename:
-            filename = url.split('/')[-1].split('?')[0] or f"video_{int(time.time())}.mp4"
-        
-        file_path = os.path.join("downloads", filename)
-        os.makedirs("downloads", exist_ok=True)
-        
-        total_size = int(response.headers.get('content-length', 0))
-        chunk_size = 1024 * 1024  # 1MB chunks
-        
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    
-                    # Update progress every 3 seconds or when done
-                    current_time = time.time()
-                    if current_time - last_update >= 3 or downloaded == total_size:
-                        elapsed = current_time - start_time
-                        percent = (downloaded / total_size) * 100
-                        
-                        # Calculate speed and ETA
-                        speed = downloaded / elapsed if elapsed > 0 else 0
-                        eta = (total_size - downloaded) / speed if speed > 0 else 0
-                        
-                        progress_text = (
-                            f"📥 Downloading...\n"
-                            f"⏳ {percent:.1f}% of {humanize.naturalsize(total_size)}\n"
-                            f"🚀 {humanize.naturalsize(speed)}/s\n"
-                            f"🕒 ETA: {humanize.naturaldelta(eta)}"
-                        )
-                        
-                        try:
-                            app.edit_message_text(
-                                chat_id=message.chat.id,
-                                message_id=message.id,
-                                text=progress_text
-                            )
-                            last_update = current_time
-                        except MessageNotModified:
-                            pass
-                        except RPCError as e:
-                            logger.error(f"Progress update failed: {e}")
+        session = http_client.get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            
+            # Try to get filename from Content-Disposition
+            filename = None
+            if 'content-disposition' in response.headers:
+                cd = response.headers['content-disposition']
+                if 'filename=' in cd:
+                    filename = cd.split('filename=')[1].strip('"\'')
+            
+            # Fallback to URL filename
+            if not filename:
+                filename = url.split('/')[-1].split('?')[0] or f"video_{int(time.time())}.mp4"
+            
+            job_dir = os.path.join("downloads", f"{message.chat.id}_{message.id}")
+            file_path = os.path.join(job_dir, os.path.basename(filename))
+            os.makedirs(job_dir, exist_ok=True)
+            
+            total_size = int(response.headers.get('content-length', 0))
+            chunk_size = 1024 * 1024  # 1MB chunks
+            
+            reporter = ProgressReporter(message, partial(render_progress, "📥 Downloading..."))
+            try:
+                with open(file_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        await reporter.update(downloaded, total_size)
+            finally:
+                await reporter.finish()
         
         return file_path
     
     except Exception as e:
         logger.error(f"Download failed: {e}")
+        if file_path:
+            remove_job_file(file_path)
         raise
 
-async def upload_file(file_path: str, message: Message):
+def remove_job_file(file_path: str) -> None:
+    """Delete a downloaded file (if it got as far as being created) and its job directory"""
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        os.rmdir(os.path.dirname(file_path))
+    except OSError as e:
+        logger.error(f"Cleanup failed: {e}")
+
+async def upload_file(file_path: str, message: Message) -> Message:
     """Upload file with proper type detection and progress"""
+    reporter = ProgressReporter(message, partial(render_progress, "📤 Uploading..."))
+    thumbnail_path = None
     try:
         file_size = os.path.getsize(file_path)
-        start_time = time.time()
-        last_update = start_time
-        uploaded = 0
-        
-        # Generate thumbnail for videos
-        thumbnail_path = None
-        if is_video_file(file_path):
-            thumbnail_path = generate_thumbnail(file_path)
+        # Decide from the file's first bytes; TeraBox names often carry no or the wrong extension
+        file_type = sniff.sniff(file_path)
+        name = sniff.file_name(file_path, file_type)
         
-        async def progress(current, total):
-            nonlocal uploaded, last_update
-            current_time = time.time()
-            
-            # Update every 3 seconds or when done
-            if current_time - last_update >= 3 or current == total:
-                elapsed = current_time - start_time
-                percent = (current / total) * 100
-                speed = current / elapsed if elapsed > 0 else 0
-                eta = (total - current) / speed if speed > 0 else 0
-                
-                progress_text = (
-                    f"📤 Uploading...\n"
-                    f"⏳ {percent:.1f}% of {humanize.naturalsize(total)}\n"
-                    f"🚀 {humanize.naturalsize(speed)}/s\n"
-                    f"🕒 ETA: {humanize.naturaldelta(eta)}"
-                )
-                
-                try:
-                    await app.edit_message_text(
-                        chat_id=message.chat.id,
-                        message_id=message.id,
-                        text=progress_text
-                    )
-                    last_update = current_time
-                except MessageNotModified:
-                    pass
-                except RPCError as e:
-                    logger.error(f"Progress update failed: {e}")
+        # Probe (and make streamable) and generate thumbnail for videos; the thumbnail is cached, so it is not removed below
+        if file_type.is_video:
+            media = await media_probe.prepare_video(file_path)
+            thumbnail_path = await thumbnails.generate(file_path)
         
         # Upload based on file type
-        if is_video_file(file_path):
-            await app.send_video(
+        if file_type.is_video:
+            sent_message = await app.send_video(
                 chat_id=message.chat.id,
                 video=file_path,
+                file_name=name,
                 thumb=thumbnail_path,
                 supports_streaming=True,
-                progress=progress,
+                **media.video_kwargs(),
+                progress=reporter.update,
                 caption="🎥 Downloaded from TeraBox"
             )
         else:
-            await app.send_document(
+            sent_message = await app.send_document(
                 chat_id=message.chat.id,
                 document=file_path,
+                file_name=name,
                 thumb=thumbnail_path,
-                progress=progress,
+                progress=reporter.update,
                 caption="📄 Downloaded from TeraBox"
             )
+        return sent_message
     
     except Exception as e:
         logger.error(f"Upload failed: {e}")
         raise
     finally:
+        await reporter.finish()
         # Cleanup
-        try:
-            os.remove(file_path)
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-        except OSError as e:
-            logger.error(f"Cleanup failed: {e}")
+        remove_job_file(file_path)
+
+def queue_position_updater(message: Message, stage: str):
+    """Return a callback that shows the user's place in the job queue"""
+    async def update(position: int):
+        await message.edit_text(f"⏳ Waiting for a free {stage} slot... (position {position} in queue)")
+    return update
 
 @app.on_message(filters.command("tb"))
 async def handle_terabox_command(client, message: Message):
@@ -251,13 +202,24 @@ async def handle_terabox_command(client, message: Message):
             f"📥 New download\nUser: {message.from_user.mention}\nURL: {text}"
         )
         
-        download_url = API_BASE_URL + text
-        await processing_msg.edit_text("⬇️ Starting download...")
-        
-        file_path = download_file(download_url, processing_msg)
-        await processing_msg.edit_text("⬆️ Starting upload...")
+        # Re-send by file_id if this share was uploaded before
+        sent_message = await file_id_cache.send_cached(
+            app, processing_msg.chat.id, share_id(text), "",
+            caption="🎥 Downloaded from TeraBox",
+            document_caption="📄 Downloaded from TeraBox"
+        )
         
-        await upload_file(file_path, processing_msg)
+        if not sent_message:
+            user_id = message.from_user.id
+            download_url = (await link_resolver.resolve(text))[resolvers.DIRECT_LINK_KEY]
+            async with download_slots.slot(user_id, queue_position_updater(processing_msg, "download")):
+                await processing_msg.edit_text("⬇️ Starting download...")
+                file_path = await download_file(download_url, processing_msg)
+            
+            async with upload_slots.slot(user_id, queue_position_updater(processing_msg, "upload")):
+                await processing_msg.edit_text("⬆️ Starting upload...")
+                sent_message = await upload_file(file_path, processing_msg)
+            file_id_cache.put(share_id(text), "", sent_message)
         await processing_msg.edit_text("✅ Download complete!")
         
         await app.send_message(
@@ -283,4 +245,5 @@ async def handle_terabox_command(client, message: Message):
 if __name__ == "__main__":
     # Create necessary directories
     os.makedirs("downloads", exist_ok=True)
-    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    # Shared HTTP pool opens with the bot and closes when it stops
+    http_client.run(app)
@@ -3,8 +3,9 @@ import asyncio
 from PIL import Image, ImageDraw, ImageFont
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from moviepy import VideoFileClip, TextClip, CompositeVideoClip
 from tempfile import NamedTemporaryFile
+from watermark_pool import WatermarkPool, PoolBusy, JobCancelled
+from watermark_engine import WatermarkStyle, watermark_video
 
 # Configuration
 API_ID = "22808125"  # Replace with your API ID
@@ -16,6 +17,9 @@ FONT_SIZE = 48
 OPACITY = 128  # 0-255
 POSITION = "bottom-right"  # Options: top-left, top-right, bottom-left, bottom-right, center
 
+# Bounded, cancellable slots for video encodes
+watermark_pool = WatermarkPool()
+
 # Create Pyrofork client
 app = Client(
     "watermark_bot",
@@ -76,49 +80,13 @@ def add_image_watermark(input_path, output_path):
         print(f"Error adding image watermark: {e}")
         return False
 
-def add_video_watermark(input_path, output_path):
-    """Add watermark to a video"""
-    try:
-        # Load the video clip
-        clip = VideoFileClip(input_path)
-        
-        # Create a text clip for the watermark
-        txt_clip = (TextClip(WATERMARK_TEXT, fontsize=FONT_SIZE, color='white',
-                           font=FONT_PATH if os.path.exists(FONT_PATH) else None)
-                   .set_opacity(OPACITY/255)
-                   .set_duration(clip.duration))
-        
-        # Get text dimensions
-        text_size = txt_clip.size
-        
-        # Determine position based on configuration
-        if POSITION == "top-left":
-            position = (10, 10)
-        elif POSITION == "top-right":
-            position = (clip.w - text_size[0] - 10, 10)
-        elif POSITION == "bottom-left":
-            position = (10, clip.h - text_size[1] - 10)
-        elif POSITION == "center":
-            position = ('center', 'center')
-        else:  # bottom-right (default)
-            position = (clip.w - text_size[0] - 10, clip.h - text_size[1] - 10)
-        
-        # Add watermark to video
-        watermarked = CompositeVideoClip([clip, txt_clip.set_pos(position)])
-        
-        # Write the result to a file
-        watermarked.write_videofile(
-            output_path,
-            codec='libx264',
-            audio_codec='aac',
-            threads=4,
-            preset='fast',
-            ffmpeg_params=['-crf', '23']
-        )
-        return True
-    except Exception as e:
-        print(f"Error adding video watermark: {e}")
-        return False
+async def add_video_watermark(input_path, output_path, watermark_text, position, opacity):
+    """Add watermark to a video by overlaying the cached text PNG in one ffmpeg pass"""
+    style = WatermarkStyle(font_file=FONT_PATH, font_size=FONT_SIZE, opacity=opacity / 255, position=position)
+    return await watermark_video(
+        input_path, output_path, watermark_text, style,
+        backlog=watermark_pool.backlog, workers=watermark_pool.workers
+    )
 
 @app.on_message(filters.command("start"))
 async def start_command(client: Client, message: Message):
@@ -131,6 +99,14 @@ async def start_command(client: Client, message: Message):
         "/opacity - Adjust watermark opacity"
     )
 
+@app.on_message(filters.command("cancel"))
+async def cancel_command(client: Client, message: Message):
+    """Handler to cancel a running video watermark"""
+    if watermark_pool.cancel(message.from_user.id):
+        await message.reply_text("🛑 Cancelling your watermark job...")
+    else:
+        await message.reply_text("You have no watermark job running.")
+
 @app.on_message(filters.photo | filters.video | filters.document)
 async def handle_media(client: Client, message: Message):
     """Handler for incoming photos and videos"""
@@ -162,15 +138,25 @@ async def handle_media(client: Client, message: Message):
             output_path = temp_file.name
         
         success = False
+        failure_text = "❌ Failed to add watermark. Please try again."
         if is_image:
             success = add_image_watermark(media_path, output_path)
             media_type = "photo"
         else:
-            success = add_video_watermark(media_path, output_path)
+            # Encode in a worker slot; ffmpeg runs in its own process, so the bot keeps answering other users
+            try:
+                success = await watermark_pool.run(
+                    message.from_user.id, add_video_watermark,
+                    media_path, output_path, WATERMARK_TEXT, POSITION, OPACITY
+                )
+            except PoolBusy:
+                success, failure_text = False, "⏳ Too many videos are queued. Please try again later."
+            except JobCancelled:
+                success, failure_text = False, "🛑 Watermark cancelled."
             media_type = "video"
         
         if not success:
-            await processing_msg.edit_text("❌ Failed to add watermark. Please try again.")
+            await processing_msg.edit_text(failure_text)
             os.remove(media_path)
             if os.path.exists(output_path):
                 os.remove(output_path)
@@ -251,5 +237,6 @@ async def set_opacity(client: Client, message: Message):
                                "To change it, send /opacity followed by a number (0-255)")
 
 # Start the bot
-print("Bot is running...")
-app.run()
+if __name__ == "__main__":
+    print("Bot is running...")
+    app.run()
@@ -1,11 +1,14 @@
 import os
 import asyncio
+from functools import partial
 from dotenv import load_dotenv
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait
-import ffmpeg
 import subprocess
+from progress import ProgressReporter
+import thumbnails
+from watermark_engine import WatermarkStyle, watermark_image, watermark_video
 
 # Load environment variables
 load_dotenv()
@@ -20,85 +23,24 @@ FONT_COLOR = os.getenv("FONT_COLOR", "white")
 FONT_FILE = os.getenv("FONT_FILE", "arial.ttf")
 POSITION = os.getenv("POSITION", "bottom_right")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 100)) * 1024 * 1024  # 100MB
+WATERMARK_INTRO = float(os.getenv("WATERMARK_INTRO", 0))  # Only watermark the first N seconds (0: whole video)
+WATERMARK_OUTRO = float(os.getenv("WATERMARK_OUTRO", 0))  # Only watermark the last N seconds (0: whole video)
 
 app = Client("watermark_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
-def get_position_args(position):
-    positions = {
-        "top_left": {"x": "10", "y": "10"},
-        "top_right": {"x": "(w-text_w)-10", "y": "10"},
-        "bottom_left": {"x": "10", "y": "(h-text_h)-10"},
-        "bottom_right": {"x": "(w-text_w)-10", "y": "(h-text_h)-10"},
-        "center": {"x": "(w-text_w)/2", "y": "(h-text_h)/2"}
-    }
-    return positions.get(position, positions["bottom_right"])
-
-async def generate_thumbnail(input_path, output_path="thumbnail.jpg", time="00:00:01"):
-    """Generate thumbnail from video"""
-    try:
-        (
-            ffmpeg
-            .input(input_path, ss=time)
-            .output(output_path, vframes=1)
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
-        )
-        return output_path if os.path.exists(output_path) else None
-    except ffmpeg.Error as e:
-        print(f"Thumbnail error: {e.stderr.decode()}")
-        return None
+# Text style shared by video and image watermarks
+WATERMARK_STYLE = WatermarkStyle(font_file=FONT_FILE, font_size=FONT_SIZE, color=FONT_COLOR, position=POSITION)
 
 async def add_watermark_to_video(input_path, output_path):
     """Add watermark to video"""
-    pos = get_position_args(POSITION)
-    try:
-        cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-vf', f"drawtext=text='{WATERMARK_TEXT}':fontfile={FONT_FILE}:"
-                   f"fontcolor={FONT_COLOR}:fontsize={FONT_SIZE}:"
-                   f"x={pos['x']}:y={pos['y']}",
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-crf', '18',
-            '-c:a', 'copy',
-            '-y',
-            output_path
-        ]
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        return os.path.exists(output_path)
-    except Exception as e:
-        print(f"Video watermark error: {str(e)}")
-        return False
+    return await watermark_video(
+        input_path, output_path, WATERMARK_TEXT, WATERMARK_STYLE,
+        intro=WATERMARK_INTRO, outro=WATERMARK_OUTRO
+    )
 
 async def add_watermark_to_image(input_path, output_path):
     """Add watermark to image"""
-    pos = get_position_args(POSITION)
-    try:
-        cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-vf', f"drawtext=text='{WATERMARK_TEXT}':fontfile={FONT_FILE}:"
-                   f"fontcolor={FONT_COLOR}:fontsize={FONT_SIZE}:"
-                   f"x={pos['x']}:y={pos['y']}",
-            '-y',
-            output_path
-        ]
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        return os.path.exists(output_path)
-    except Exception as e:
-        print(f"Image watermark error: {str(e)}")
-        return False
+    return await watermark_image(input_path, output_path, WATERMARK_TEXT, WATERMARK_STYLE)
 
 @app.on_message(filters.command(["start", "help"]) & filters.private)
 async def start_handler(client: Client, message: Message):
@@ -130,18 +72,21 @@ async def media_handler(client: Client, message: Message):
         unique_id = message.video.file_unique_id if is_video else message.photo.file_unique_id
         input_path = f"downloads/input_{unique_id}.{'mp4' if is_video else 'jpg'}"
         output_path = f"downloads/output_{unique_id}.{'mp4' if is_video else 'jpg'}"
-        thumbnail_path = f"downloads/thumb_{unique_id}.jpg"
+        thumbnail_path = None
 
         # Ensure downloads directory exists
         os.makedirs("downloads", exist_ok=True)
 
         # Download file
         try:
-            await message.download(
-                file_name=input_path,
-                progress=progress_callback,
-                progress_args=(sent_msg, "Downloading")
-            )
+            download_progress = ProgressReporter(sent_msg, partial(render_progress, "Downloading"))
+            try:
+                await message.download(
+                    file_name=input_path,
+                    progress=download_progress.update
+                )
+            finally:
+                await download_progress.finish()
         except Exception as e:
             await sent_msg.edit_text(f"Download failed: {str(e)}")
             return
@@ -149,7 +94,7 @@ async def media_handler(client: Client, message: Message):
         # Generate thumbnail for videos
         if is_video:
             await sent_msg.edit_text("Generating thumbnail...")
-            await generate_thumbnail(input_path, thumbnail_path)
+            thumbnail_path = await thumbnails.generate(input_path)
 
         # Add watermark
         await sent_msg.edit_text(f"Adding watermark to {file_type}...")
@@ -166,27 +111,30 @@ async def media_handler(client: Client, message: Message):
 
         # Upload result
         await sent_msg.edit_text(f"Uploading watermarked {file_type}...")
+        upload_progress = ProgressReporter(sent_msg, partial(render_progress, "Uploading"))
         try:
             if is_video:
                 await message.reply_video(
                     video=output_path,
-                    thumb=thumbnail_path if os.path.exists(thumbnail_path) else None,
+                    thumb=thumbnail_path,
                     caption="Here's your watermarked video!",
-                    progress=progress_callback,
-                    progress_args=(sent_msg, "Uploading")
+                    progress=upload_progress.update
                 )
             else:
                 await message.reply_photo(
                     photo=output_path,
                     caption="Here's your watermarked image!"
                 )
+            await upload_progress.finish()
         except Exception as e:
+            await upload_progress.finish()
             await sent_msg.edit_text(f"Upload failed: {str(e)}")
             return
 
         # Clean up
         await sent_msg.delete()
-        for file_path in [input_path, output_path, thumbnail_path]:
+        # The thumbnail stays in the thumbnail cache
+        for file_path in [input_path, output_path]:
             try:
                 if file_path and os.path.exists(file_path):
                     os.remove(file_path)
@@ -198,12 +146,9 @@ async def media_handler(client: Client, message: Message):
     except Exception as e:
         await message.reply_text(f"An error occurred: {str(e)}")
 
-async def progress_callback(current, total, message: Message, stage):
-    try:
-        percent = min(int(current * 100 / total), 100)
-        await message.edit_text(f"{stage}... {percent}%")
-    except:
-        pass
+def render_progress(stage, current, total, speed, eta):
+    percent = min(int(current * 100 / total), 100) if total else 0
+    return f"{stage}... {percent}%"
 
 if __name__ == "__main__":
     os.makedirs("downloads", exist_ok=True)
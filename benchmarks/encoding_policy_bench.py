@@ -0,0 +1,103 @@
+"""Encode time and output size for each encoding_policy decision.
+
+Encodes one clip with the settings choose_settings picks at increasing
+backlog, next to the fixed settings the bots used before the policy
+(ultrafast/23 in text*.py, fast/23 in Watermark1.py, fast/18 in
+Watermarkw.py). Only the video is encoded and no overlay is drawn, since
+both cost the same under every setting.
+
+    python benchmarks/encoding_policy_bench.py [clip] [--workers N]
+
+Without a clip, a 10 s 1920x1080 30 fps testsrc2 clip with light temporal
+noise is generated. Uses FFMPEG_BINARY / FFPROBE_BINARY like the bots.
+
+Recorded with ffmpeg 6.0 (libx264) on one core, default clip, --workers 4:
+
+    setting                          preset     crf  threads  size        encode    output
+    old text*.py                     ultrafast  23   1        1920x1080    16.0 s   16.4 MB
+    old Watermark1.py                fast       23   1        1920x1080    39.8 s    7.8 MB
+    old Watermarkw.py                fast       18   1        1920x1080    48.4 s   15.0 MB
+    policy, backlog 1                faster     23   1        1920x1080    35.0 s    7.5 MB
+    policy, backlog 5 (> workers)    veryfast   24   1        1920x1080    27.7 s    5.9 MB
+    policy, backlog 8 (2x workers)   superfast  25   1        1280x720     15.9 s    2.3 MB
+    policy, backlog 16 (4x workers)  superfast  27   1        1280x720     17.4 s    1.6 MB
+
+The two superfast rows differ only in CRF; their times are within run-to-run noise.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoding_policy import EncodingSettings, choose_settings, probe_video  # noqa: E402
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+CLIP_SECONDS = 10
+
+
+def make_clip(path: str) -> None:
+    subprocess.run([
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=30:duration={CLIP_SECONDS},noise=alls=3:allf=t",
+        "-c:v", "libx264", "-preset", "ultrafast", "-qp", "0", path
+    ], check=True)
+
+
+def encode(clip: str, output: str, settings: EncodingSettings, scale) -> float:
+    """Encode clip with settings; returns the wall time in seconds"""
+    args = [
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-i", clip, "-an",
+        *(["-vf", scale] if scale else []),
+        "-c:v", "libx264", "-preset", settings.preset, "-crf", str(settings.crf),
+        "-threads", str(settings.threads), output
+    ]
+    started = time.perf_counter()
+    subprocess.run(args, check=True)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("clip", nargs="?", help="video to encode; a test clip is generated if omitted")
+    parser.add_argument("--workers", type=int, default=4, help="worker count the backlog is measured against")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="policy_bench_") as work_dir:
+        clip = options.clip
+        if not clip:
+            clip = os.path.join(work_dir, "clip.mkv")
+            make_clip(clip)
+        info = asyncio.run(probe_video(clip))
+        if not info:
+            sys.exit(f"Can't probe {clip}")
+
+        workers = options.workers
+        rows = [
+            ("old text*.py", EncodingSettings("ultrafast", 23, 0)),
+            ("old Watermark1.py", EncodingSettings("fast", 23, 0)),
+            ("old Watermarkw.py", EncodingSettings("fast", 18, 0)),
+        ]
+        for backlog, note in [(1, ""), (workers + 1, " (> workers)"), (2 * workers, " (2x workers)"),
+                              (4 * workers, " (4x workers)")]:
+            rows.append((f"policy, backlog {backlog}{note}", choose_settings(info, backlog, workers)))
+
+        print(f"{'setting':<32} {'preset':<10} {'crf':<4} {'threads':<8} {'size':<10} {'encode':>7} {'output':>9}")
+        for name, settings in rows:
+            output = os.path.join(work_dir, "out.mp4")
+            scale = settings.scale_filter(info)
+            seconds = encode(clip, output, settings, scale)
+            size = os.path.getsize(output) / 1e6
+            encoded = asyncio.run(probe_video(output))
+            threads = settings.threads or os.cpu_count()
+            print(f"{name:<32} {settings.preset:<10} {settings.crf:<4} {threads:<8} "
+                  f"{f'{encoded.width}x{encoded.height}':<10} "
+                  f"{seconds:6.1f} s {size:6.1f} MB", flush=True)
+
+
+if __name__ == "__main__":
+    main()
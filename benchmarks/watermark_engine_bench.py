@@ -0,0 +1,144 @@
+"""Throughput and peak memory of watermark_engine against the old moviepy path.
+
+The moviepy path is add_watermark as text*.py had it before
+watermark_engine: CompositeVideoClip over the video, write_videofile with
+libx264 ultrafast and AAC audio. TextClip needs ImageMagick, so the text is
+rasterized by overlay_cache.render_overlay into an ImageClip instead; the
+compositing and encoding are unchanged. watermark_engine runs once with the
+old ultrafast preset and once with the preset encoding_policy picks.
+
+    python benchmarks/watermark_engine_bench.py [clip]
+
+Without a clip, a 20 s 1280x720 30 fps testsrc2 clip with a sine audio
+track is generated. Each path runs in its own process; "python RSS" is that
+process's peak, "ffmpeg RSS" the largest ffmpeg it started. moviepy uses
+IMAGEIO_FFMPEG_EXE, watermark_engine FFMPEG_BINARY; point both at the same
+ffmpeg.
+
+Recorded with ffmpeg 6.0 and moviepy 1.0.3 on one core, default clip:
+
+    path                             wall    fps  python RSS  ffmpeg RSS
+    moviepy (old text*.py)         20.6 s   29.1     155 MB     127 MB
+    engine, ultrafast               5.2 s  116.4      30 MB      50 MB
+    engine, encoding_policy        18.2 s   32.9      28 MB     169 MB
+
+The policy row encodes with "fast", whose lookahead accounts for the larger ffmpeg.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+CLIP_SECONDS = 20
+TEXT = "@watermark_bench"
+
+
+def make_clip(path: str) -> None:
+    subprocess.run([
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={CLIP_SECONDS}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={CLIP_SECONDS}",
+        "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-shortest", path
+    ], check=True)
+
+
+def run_moviepy(clip: str, output: str) -> None:
+    from moviepy.editor import CompositeVideoClip, ImageClip, VideoFileClip
+
+    from overlay_cache import render_overlay
+    from watermark_engine import WatermarkStyle
+
+    png = output + ".png"
+    render_overlay(TEXT, WatermarkStyle(font_size=50, stroke_color="black", stroke_width=1), png)
+    video = VideoFileClip(clip)
+    txt_clip = (
+        ImageClip(png)
+        .set_position(("center", "bottom"))
+        .set_duration(video.duration)
+        .set_opacity(0.7)
+    )
+    final_clip = CompositeVideoClip([video, txt_clip])
+    final_clip.write_videofile(
+        output, codec="libx264", audio_codec="aac", threads=4, preset="ultrafast", logger=None
+    )
+    final_clip.close()
+    video.close()
+
+
+def run_engine(clip: str, output: str, preset: str) -> None:
+    import encoding_policy
+    from watermark_engine import WatermarkStyle, watermark_video
+
+    if preset:
+        encoding_policy.BASE_PRESET = preset
+    style = WatermarkStyle(font_size=50, opacity=0.7, stroke_color="black", stroke_width=1,
+                           position="bottom-center")
+    if not asyncio.run(watermark_video(clip, output, TEXT, style, backlog=1)):
+        sys.exit("watermark_video failed")
+
+
+def child(path: str, clip: str, output: str) -> None:
+    """Run one path and print its timing and peak memory as JSON"""
+    started = time.perf_counter()
+    if path == "moviepy":
+        run_moviepy(clip, output)
+    else:
+        run_engine(clip, output, "ultrafast" if path == "engine-ultrafast" else "")
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "seconds": elapsed,
+        "python_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "ffmpeg_rss": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+
+def count_frames(path: str) -> int:
+    ffprobe = os.getenv("FFPROBE_BINARY", "ffprobe")
+    result = subprocess.run([
+        ffprobe, "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", path
+    ], capture_output=True, text=True, check=True)
+    return int(result.stdout.strip())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("clip", nargs="?", help="video to watermark; a test clip is generated if omitted")
+    parser.add_argument("--child", nargs=3, metavar=("PATH", "CLIP", "OUTPUT"), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    if options.child:
+        child(*options.child)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="watermark_bench_") as work_dir:
+        clip = options.clip
+        if not clip:
+            clip = os.path.join(work_dir, "clip.mp4")
+            make_clip(clip)
+        frames = count_frames(clip)
+        env = dict(os.environ, OVERLAY_DIR=os.path.join(work_dir, "overlays"))
+
+        print(f"{'path':<29} {'wall':>7} {'fps':>6} {'python RSS':>11} {'ffmpeg RSS':>11}")
+        for path, name in [("moviepy", "moviepy (old text*.py)"), ("engine-ultrafast", "engine, ultrafast"),
+                           ("engine", "engine, encoding_policy")]:
+            output = os.path.join(work_dir, f"{path}.mp4")
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", path, clip, output],
+                env=env, capture_output=True, text=True, check=True
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{name:<29} {stats['seconds']:5.1f} s {frames / stats['seconds']:6.1f} "
+                  f"{stats['python_rss']:7.0f} MB {stats['ffmpeg_rss']:7.0f} MB", flush=True)
+
+
+if __name__ == "__main__":
+    main()
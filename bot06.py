@@ -1,10 +1,13 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-import aiohttp
 import os
 import re
 import logging
 import asyncio
+import downloader
+import http_client
+import media_probe
+from progress import ProgressReporter
 import math
 from datetime import datetime
 import hashlib
@@ -32,8 +35,8 @@ TERABOX_REGEX = re.compile(
 CHUNK_SIZE = 1024 * 1024 * 4  # 4MB chunks
 TIMEOUT = 3600  # 60 minutes timeout
 TEMP_DIR = "temp_downloads"
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 8))  # Parallel Range connections per download
 MAX_RETRIES = 3
-PROGRESS_UPDATE_THRESHOLD = 5  # Minimum percentage change to update progress
 
 # Cache for download links
 download_cache = {}
@@ -79,64 +82,47 @@ async def safe_edit_message(message: Message, text: str):
 
 async def download_file_with_progress(url: str, file_path: str, message: Message) -> None:
     """Download a file with progress updates"""
-    last_progress = -PROGRESS_UPDATE_THRESHOLD  # Ensure first update happens
+    def render(downloaded_size: int, total_size: int, speed: float, eta: float) -> str:
+        progress = (downloaded_size / total_size) * 100 if total_size > 0 else 0
+        return (
+            f"⬇️ Downloading...\n"
+            f"{progress_bar(progress)} {progress:.1f}%\n"
+            f"{format_size(downloaded_size)} / {format_size(total_size)}\n"
+            f"🚀 {format_size(int(speed))}/s, ETA {int(eta)}s"
+        )
     
-    for attempt in range(MAX_RETRIES):
-        try:
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        raise DownloadError(f"Failed to download file. Status: {response.status}")
-                    
-                    total_size = int(response.headers.get('content-length', 0))
-                    downloaded_size = 0
-                    
-                    with open(file_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                            if chunk:  # Ensure chunk is not empty
-                                f.write(chunk)
-                                downloaded_size += len(chunk)
-                                
-                                progress = (downloaded_size / total_size) * 100 if total_size > 0 else 0
-                                
-                                # Only update if progress changed significantly
-                                if abs(progress - last_progress) >= PROGRESS_UPDATE_THRESHOLD:
-                                    bar = progress_bar(progress)
-                                    await safe_edit_message(
-                                        message,
-                                        f"⬇️ Downloading...\n"
-                                        f"{bar} {progress:.1f}%\n"
-                                        f"{format_size(downloaded_size)} / {format_size(total_size)}"
-                                    )
-                                    last_progress = progress
-                    return
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                raise DownloadError(f"Download failed after {MAX_RETRIES} attempts: {str(e)}")
-            await asyncio.sleep(5)
-            continue
+    reporter = ProgressReporter(message, render)
+    
+    try:
+        for attempt in range(MAX_RETRIES):
+            try:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                
+                # Each attempt resumes from the on-disk journal instead of starting over
+                await downloader.download(url, file_path, progress=reporter.update, connections=DOWNLOAD_CONNECTIONS)
+                return
+            except Exception as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise DownloadError(f"Download failed after {MAX_RETRIES} attempts: {str(e)}")
+                await asyncio.sleep(5)
+                continue
+    finally:
+        await reporter.finish()
 
 async def upload_file_with_progress(client: Client, message: Message, file_path: str, caption: str, is_video: bool) -> Message:
     """Upload file with progress updates"""
     upload_msg = await message.reply("⬆️ Preparing upload...")
-    last_progress = -PROGRESS_UPDATE_THRESHOLD  # Ensure first update happens
     
-    async def progress(current, total):
-        nonlocal last_progress
-        progress_percent = (current / total) * 100
-        
-        # Only update if progress changed significantly
-        if abs(progress_percent - last_progress) >= PROGRESS_UPDATE_THRESHOLD:
-            bar = progress_bar(progress_percent)
-            await safe_edit_message(
-                upload_msg,
-                f"⬆️ Uploading...\n"
-                f"{bar} {progress_percent:.1f}%\n"
-                f"{format_size(current)} / {format_size(total)}"
-            )
-            last_progress = progress_percent
+    def render(current: int, total: int, speed: float, eta: float) -> str:
+        progress_percent = (current / total) * 100 if total > 0 else 0
+        return (
+            f"⬆️ Uploading...\n"
+            f"{progress_bar(progress_percent)} {progress_percent:.1f}%\n"
+            f"{format_size(current)} / {format_size(total)}\n"
+            f"🚀 {format_size(int(speed))}/s, ETA {int(eta)}s"
+        )
+    
+    reporter = ProgressReporter(upload_msg, render)
     
     for attempt in range(MAX_RETRIES):
         try:
@@ -144,21 +130,24 @@ async def upload_file_with_progress(client: Client, message: Message, file_path:
                 raise DownloadError("File not found for upload")
             
             if is_video:
+                media = await media_probe.prepare_video(file_path)
                 sent_message = await client.send_video(
                     chat_id=message.chat.id,
                     video=file_path,
                     caption=caption,
                     supports_streaming=True,
-                    progress=progress
+                    **media.video_kwargs(),
+                    progress=reporter.update
                 )
             else:
                 sent_message = await client.send_document(
                     chat_id=message.chat.id,
                     document=file_path,
                     caption=caption,
-                    progress=progress
+                    progress=reporter.update
                 )
             
+            await reporter.finish()
             try:
                 await upload_msg.delete()
             except:
@@ -167,7 +156,7 @@ async def upload_file_with_progress(client: Client, message: Message, file_path:
             
         except Exception as e:
             if attempt == MAX_RETRIES - 1:
-                await safe_edit_message(upload_msg, f"❌ Upload failed after {MAX_RETRIES} attempts: {str(e)}")
+                await reporter.finish(f"❌ Upload failed after {MAX_RETRIES} attempts: {str(e)}")
                 raise DownloadError(f"Upload failed: {str(e)}")
             await asyncio.sleep(5)
             continue
@@ -177,4 +166,7 @@ async def upload_file_with_progress(client: Client, message: Message, file_path:
 if __name__ == "__main__":
     logger.info("Starting TeraBox Downloader Bot...")
     os.makedirs(TEMP_DIR, exist_ok=True)
-    app.run()
+    # Drop partial downloads nobody came back for
+    downloader.cleanup_stale(TEMP_DIR)
+    # Shared HTTP pool opens with the bot and closes when it stops
+    http_client.run(app)
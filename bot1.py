@@ -1,6 +1,9 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-import aiohttp
+import http_client
+import resolvers
+import sniff
+from metadata_cache import MetadataCache
 import os
 import re
 from typing import Optional
@@ -32,39 +35,37 @@ TIMEOUT = 300  # 5 minutes timeout for operations
 # Cache for user preferences
 user_prefs = {}
 
+# Cache for TeraBox file info, keyed by share ID
+file_info_cache = MetadataCache()
+
+# Share links go to whichever TeraBox API is answering fastest
+file_info_resolver = resolvers.terabox_resolver()
+
 class DownloadError(Exception):
     """Custom exception for download-related errors"""
     pass
 
 async def download_file(url: str, file_path: str) -> None:
     """Download a file from URL to local storage"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise DownloadError(f"Failed to download file. Status: {response.status}")
-            
-            with open(file_path, 'wb') as f:
-                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                    f.write(chunk)
+    session = http_client.get_session()
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise DownloadError(f"Failed to download file. Status: {response.status}")
+        
+        with open(file_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                f.write(chunk)
+
+async def fetch_file_info(link: str) -> dict:
+    """Get file information from the fastest healthy TeraBox API"""
+    try:
+        return await file_info_resolver.resolve(link)
+    except resolvers.ResolveError as e:
+        raise DownloadError(str(e))
 
 async def get_file_info(link: str) -> dict:
-    """Get file information from TeraBox API"""
-    async with aiohttp.ClientSession() as session:
-        api_url = f"https://wdzone-terabox-api.vercel.app/api?url={link}"
-        try:
-            async with session.get(api_url, timeout=TIMEOUT) as resp:
-                if resp.status != 200:
-                    raise DownloadError("Failed to connect to the API")
-                
-                data = await resp.json()
-                file_info = data.get("📜 Extracted Info", [{}])[0]
-                
-                if data.get("✅ Status") != "Success" or not file_info:
-                    raise DownloadError("No downloadable file found")
-                
-                return file_info
-        except aiohttp.ClientError as e:
-            raise DownloadError(f"API request failed: {str(e)}")
+    """Get file information, reusing a recent lookup of the same share"""
+    return await file_info_cache.get_or_fetch(link, fetch_file_info)
 
 @app.on_message(filters.command("start"))
 async def start_handler(client: Client, message: Message):
@@ -163,10 +164,14 @@ async def link_handler(client: Client, message: Message):
                 # Upload the file
                 await processing_msg.edit_text("⬆️ Uploading file...")
                 
-                if file_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
+                # Choose video or document from the content, not the API's title
+                file_type = sniff.sniff(file_path)
+                name = sniff.file_name(file_path, file_type)
+                if file_type.is_video:
                     # Upload as video
                     await message.reply_video(
                         video=file_path,
+                        file_name=name,
                         caption=caption,
                         supports_streaming=True,
                         progress=lambda current, total: logger.info(f"Uploaded {current}/{total} bytes")
@@ -175,6 +180,7 @@ async def link_handler(client: Client, message: Message):
                     # Upload as document
                     await message.reply_document(
                         document=file_path,
+                        file_name=name,
                         caption=caption,
                         progress=lambda current, total: logger.info(f"Uploaded {current}/{total} bytes")
                     )
@@ -186,6 +192,8 @@ async def link_handler(client: Client, message: Message):
                 
             except Exception as upload_error:
                 logger.error(f"Upload failed: {str(upload_error)}")
+                # The direct link may have expired; look it up again next time
+                file_info_cache.invalidate(link)
                 # Fall back to sending the link
                 should_upload = False
         
@@ -212,4 +220,5 @@ async def link_handler(client: Client, message: Message):
 
 if __name__ == "__main__":
     logger.info("Starting TeraBox Downloader Bot...")
-    app.run()
+    # Shared HTTP pool opens with the bot and closes when it stops
+    http_client.run(app)
@@ -1,11 +1,20 @@
 from pyrofork import Client, filters
 from pyrofork.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-import aiohttp
 import os
 import re
 import logging
 from typing import Optional
 import asyncio
+import downloader
+import http_client
+import media_probe
+import pipeline
+import resolvers
+import sniff
+from progress import ProgressReporter
+from metadata_cache import MetadataCache, share_id
+from file_id_cache import FileIdCache
+from job_queue import FairScheduler, DOWNLOAD_WORKERS, UPLOAD_WORKERS
 
 # Configure logging
 logging.basicConfig(
@@ -30,93 +39,110 @@ MAX_UPLOAD_SIZE_MB = 500  # Increased to 500MB
 CHUNK_SIZE = 1024 * 1024 * 4  # 4MB chunks for better performance
 TIMEOUT = 1800  # 30 minutes timeout for large files
 TEMP_DIR = "temp_downloads"  # Temporary directory for downloads
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 8))  # Parallel Range connections per download
+STREAM_THROUGH = os.getenv("STREAM_THROUGH", "0") == "1"  # Upload while downloading
 
 # Cache for user preferences
 user_prefs = {}
 
+# Cache for TeraBox file info, keyed by share ID
+file_info_cache = MetadataCache()
+
+# Share links go to whichever TeraBox API is answering fastest
+file_info_resolver = resolvers.terabox_resolver()
+
+# Telegram file_ids of files already uploaded, so repeats cost no transfer
+file_id_cache = FileIdCache()
+
+# Shared job slots, handed out round-robin between users
+download_slots = FairScheduler(DOWNLOAD_WORKERS)
+upload_slots = FairScheduler(UPLOAD_WORKERS)
+
 class DownloadError(Exception):
     """Custom exception for download-related errors"""
     pass
 
 async def download_file_with_progress(url: str, file_path: str, message: Message) -> None:
     """Download a file from URL to local storage with progress updates"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise DownloadError(f"Failed to download file. Status: {response.status}")
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            last_update = 0
-            
-            with open(file_path, 'wb') as f:
-                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    
-                    # Update progress every 5% or 10MB, whichever comes first
-                    progress = (downloaded_size / total_size) * 100
-                    if progress - last_update >= 5 or downloaded_size - last_update >= 10 * 1024 * 1024:
-                        await message.edit_text(
-                            f"⬇️ Downloading... {downloaded_size/(1024*1024):.1f}MB / {total_size/(1024*1024):.1f}MB "
-                            f"({progress:.1f}%)"
-                        )
-                        last_update = progress
+    def render(downloaded_size: int, total_size: int, speed: float, eta: float) -> str:
+        progress = (downloaded_size / total_size) * 100 if total_size > 0 else 0
+        return (
+            f"⬇️ Downloading... {downloaded_size/(1024*1024):.1f}MB / {total_size/(1024*1024):.1f}MB "
+            f"({progress:.1f}%)\n"
+            f"🚀 {speed/(1024*1024):.1f}MB/s, ETA {int(eta)}s"
+        )
+    
+    reporter = ProgressReporter(message, render)
+    try:
+        await downloader.download(url, file_path, progress=reporter.update, connections=DOWNLOAD_CONNECTIONS)
+    except downloader.DownloadError as e:
+        raise DownloadError(str(e))
+    finally:
+        await reporter.finish()
+
+async def fetch_file_info(link: str) -> dict:
+    """Get file information from the fastest healthy TeraBox API"""
+    try:
+        return await file_info_resolver.resolve(link)
+    except resolvers.ResolveError as e:
+        raise DownloadError(str(e))
 
 async def get_file_info(link: str) -> dict:
-    """Get file information from TeraBox API"""
-    async with aiohttp.ClientSession() as session:
-        api_url = f"https://wdzone-terabox-api.vercel.app/api?url={link}"
-        try:
-            async with session.get(api_url, timeout=60) as resp:
-                if resp.status != 200:
-                    raise DownloadError("Failed to connect to the API")
-                
-                data = await resp.json()
-                file_info = data.get("📜 Extracted Info", [{}])[0]
-                
-                if data.get("✅ Status") != "Success" or not file_info:
-                    raise DownloadError("No downloadable file found")
-                
-                return file_info
-        except aiohttp.ClientError as e:
-            raise DownloadError(f"API request failed: {str(e)}")
+    """Get file information, reusing a recent lookup of the same share"""
+    return await file_info_cache.get_or_fetch(link, fetch_file_info)
 
-async def upload_file_with_progress(client: Client, message: Message, file_path: str, caption: str, is_video: bool) -> None:
+async def upload_file_with_progress(client: Client, message: Message, file_path: str, caption: str) -> Message:
     """Upload file to Telegram with progress updates"""
+    # Pick the upload method and name from the content; API titles often have a wrong or missing extension
+    file_type = sniff.sniff(file_path)
+    name = sniff.file_name(file_path, file_type)
     upload_msg = await message.reply("⬆️ Starting upload...")
     
-    def progress(current, total):
+    def render(current: int, total: int, speed: float, eta: float) -> str:
         progress_percent = (current / total) * 100
-        asyncio.create_task(
-            upload_msg.edit_text(
-                f"⬆️ Uploading... {current/(1024*1024):.1f}MB / {total/(1024*1024):.1f}MB "
-                f"({progress_percent:.1f}%)"
-            )
+        return (
+            f"⬆️ Uploading... {current/(1024*1024):.1f}MB / {total/(1024*1024):.1f}MB "
+            f"({progress_percent:.1f}%)\n"
+            f"🚀 {speed/(1024*1024):.1f}MB/s, ETA {int(eta)}s"
         )
     
+    reporter = ProgressReporter(upload_msg, render)
+    
     try:
-        if is_video:
-            await client.send_video(
+        if file_type.is_video:
+            # Stream-through uploads pass a file that is still downloading; only finished files are probed
+            media = await media_probe.prepare_video(file_path) if isinstance(file_path, str) else media_probe.MediaInfo()
+            sent_message = await client.send_video(
                 chat_id=message.chat.id,
                 video=file_path,
                 caption=caption,
+                file_name=name,
                 supports_streaming=True,
-                progress=progress
+                **media.video_kwargs(),
+                progress=pipeline.paced_progress(file_path, reporter.update)
             )
         else:
-            await client.send_document(
+            sent_message = await client.send_document(
                 chat_id=message.chat.id,
                 document=file_path,
+                file_name=name,
                 caption=caption,
-                progress=progress
+                progress=pipeline.paced_progress(file_path, reporter.update)
             )
         
+        await reporter.finish()
         await upload_msg.delete()
+        return sent_message
     except Exception as e:
-        await upload_msg.edit_text(f"❌ Upload failed: {str(e)}")
+        await reporter.finish(f"❌ Upload failed: {str(e)}")
         raise
 
+def queue_position_updater(message: Message, stage: str):
+    """Return a callback that shows the user's place in the job queue"""
+    async def update(position: int):
+        await message.edit_text(f"⏳ Waiting for a free {stage} slot... (position {position} in queue)")
+    return update
+
 @app.on_message(filters.command("start"))
 async def start_handler(client: Client, message: Message):
     """Handle /start command"""
@@ -196,33 +222,52 @@ async def link_handler(client: Client, message: Message):
         should_upload = upload_mode and size_mb > 0 and size_mb <= MAX_UPLOAD_SIZE_MB
         
         if should_upload:
+            # Re-send by file_id if this exact file was uploaded before
+            if await file_id_cache.send_cached(client, message.chat.id, share_id(link), size_text, caption):
+                await processing_msg.delete()
+                return
+            
             try:
                 # Create temp directory if it doesn't exist
                 os.makedirs(TEMP_DIR, exist_ok=True)
                 file_path = os.path.join(TEMP_DIR, title)
                 
-                # Download the file with progress updates
-                await processing_msg.edit_text("⬇️ Starting download...")
-                await download_file_with_progress(download_link, file_path, processing_msg)
-                
-                # Verify the actual downloaded file size
-                actual_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-                if actual_size_mb > MAX_UPLOAD_SIZE_MB:
-                    raise DownloadError(f"File too large ({actual_size_mb:.1f}MB > {MAX_UPLOAD_SIZE_MB}MB)")
+                # Other jobs for the same share or title use this path too; wait for them to finish with it
+                async with downloader.claim(file_path):
+                    if STREAM_THROUGH:
+                        # Start uploading while the download is still running
+                        async with download_slots.slot(user_id, queue_position_updater(processing_msg, "download")):
+                            async with upload_slots.slot(user_id, queue_position_updater(processing_msg, "upload")):
+                                await processing_msg.edit_text("⬇️ Downloading and ⬆️ uploading...")
+                                sent_message = await pipeline.download_and_upload(
+                                    download_link, file_path,
+                                    lambda source: upload_file_with_progress(client, message, source, caption)
+                                )
+                    else:
+                        # Download the file with progress updates
+                        async with download_slots.slot(user_id, queue_position_updater(processing_msg, "download")):
+                            await processing_msg.edit_text("⬇️ Starting download...")
+                            await download_file_with_progress(download_link, file_path, processing_msg)
                 
-                # Determine if it's a video file
-                is_video = any(file_path.lower().endswith(ext) for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm']
+                        # Verify the actual downloaded file size
+                        actual_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+                        if actual_size_mb > MAX_UPLOAD_SIZE_MB:
+                            raise DownloadError(f"File too large ({actual_size_mb:.1f}MB > {MAX_UPLOAD_SIZE_MB}MB)")
                 
-                # Upload the file with progress updates
-                await upload_file_with_progress(client, message, file_path, caption, is_video)
+                        # Upload the file with progress updates
+                        async with upload_slots.slot(user_id, queue_position_updater(processing_msg, "upload")):
+                            sent_message = await upload_file_with_progress(client, message, file_path, caption)
+                    file_id_cache.put(share_id(link), size_text, sent_message)
                 
-                # Clean up
-                os.remove(file_path)
+                    # Clean up
+                    os.remove(file_path)
                 await processing_msg.delete()
                 return
                 
             except Exception as upload_error:
                 logger.error(f"Upload failed: {str(upload_error)}")
+                # The direct link may have expired; look it up again next time
+                file_info_cache.invalidate(link)
                 # Fall back to sending the link
                 should_upload = False
                 await processing_msg.edit_text("⚠️ Upload failed, sending download link instead...")
@@ -259,4 +304,7 @@ if __name__ == "__main__":
     logger.info("Starting TeraBox Downloader Bot...")
     # Create temp directory if it doesn't exist
     os.makedirs(TEMP_DIR, exist_ok=True)
-    app.run()
+    # Drop partial downloads nobody came back for
+    downloader.cleanup_stale(TEMP_DIR)
+    # Shared HTTP pool opens with the bot and closes when it stops
+    http_client.run(app)
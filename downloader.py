@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override per call or through environment variables)
+DEFAULT_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 8))
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024  # Don't split files into segments smaller than 8MB
+CHUNK_SIZE = 1024 * 1024  # 1MB reads per segment
+SEGMENT_RETRIES = 5  # Retry attempts per segment before giving up
+PROGRESS_INTERVAL = 1  # Seconds between progress callbacks
+JOURNAL_SUFFIX = ".journal"  # Partial-download state lives next to the file it describes
+JOURNAL_SAVE_INTERVAL = 2  # Seconds between journal writes while downloading
+JOURNAL_MAX_AGE = 24 * 3600  # Partial downloads untouched for this long are discarded
+
+CONTENT_RANGE_REGEX = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', re.IGNORECASE)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+# Paths claimed by a running job -> (lock, number of jobs holding or waiting for it)
+_claims: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded"""
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    """Raised when the server answers a Range request with the whole body"""
+    pass
+
+
+async def probe(session: aiohttp.ClientSession, url: str) -> Tuple[int, bool, Optional[str]]:
+    """Return (total_size, accepts_ranges, etag) for a URL using a one-byte Range request"""
+    # Many CDNs reject HEAD, so ask for the first byte instead
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+        etag = response.headers.get("ETag")
+        if response.status == 206:
+            match = CONTENT_RANGE_REGEX.match(response.headers.get("Content-Range", ""))
+            if match and match.group(3) != "*":
+                return int(match.group(3)), True, etag
+            return 0, False, etag
+        if response.status == 200:
+            return int(response.headers.get("Content-Length", 0)), False, etag
+        raise DownloadError(f"Failed to download file. Status: {response.status}")
+
+
+def split_ranges(total_size: int, connections: int) -> List[Tuple[int, int]]:
+    """Split [0, total_size) into inclusive byte ranges of at least MIN_SEGMENT_SIZE"""
+    count = max(1, min(connections, total_size // MIN_SEGMENT_SIZE))
+    segment_size = -(-total_size // count)  # Ceiling division
+    return [
+        (start, min(start + segment_size, total_size) - 1)
+        for start in range(0, total_size, segment_size)
+    ]
+
+
+class _Segment:
+    """Byte range of a file plus how much of it has been written"""
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    @property
+    def done(self) -> bool:
+        return self.position > self.end
+
+    @property
+    def completed(self) -> int:
+        return self.position - self.start
+
+
+class Journal:
+    """On-disk record of the byte ranges of a partial download that are already written.
+
+    The journal is keyed by the destination path rather than the URL because
+    TeraBox direct links are re-signed on every lookup; the ETag and size
+    decide whether a journal still describes the same file.
+    """
+
+    def __init__(self, file_path: str, url: str, etag: Optional[str], total_size: int,
+                 segments: List[_Segment]):
+        self.path = file_path + JOURNAL_SUFFIX
+        self.url = url
+        self.etag = etag
+        self.total_size = total_size
+        self.segments = segments
+        self.last_save = 0.0
+
+    @classmethod
+    def load(cls, file_path: str, url: str, etag: Optional[str], total_size: int) -> Optional["Journal"]:
+        """Return the journal for file_path if it matches the remote file, else None"""
+        try:
+            with open(file_path + JOURNAL_SUFFIX) as f:
+                data = json.load(f)
+            if data["size"] != total_size or os.path.getsize(file_path) != total_size:
+                return None
+            if etag and data.get("etag") and data["etag"] != etag:
+                return None
+            segments = []
+            for start, position, end in data["segments"]:
+                segment = _Segment(start, end)
+                segment.position = position
+                segments.append(segment)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return cls(file_path, url, etag, total_size, segments)
+
+    def save(self, force: bool = False) -> None:
+        """Atomically write the journal, at most every JOURNAL_SAVE_INTERVAL seconds"""
+        now = time.time()
+        if not force and now - self.last_save < JOURNAL_SAVE_INTERVAL:
+            return
+        data = {
+            "url": self.url,
+            "etag": self.etag,
+            "size": self.total_size,
+            "segments": [[s.start, s.position, s.end] for s in self.segments],
+            "updated": now,
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self.last_save = now
+        except OSError as e:
+            logger.warning(f"Failed to save download journal: {str(e)}")
+
+    def remove(self) -> None:
+        """Delete the journal once the download is complete"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def cleanup_stale(directory: str, max_age: int = JOURNAL_MAX_AGE) -> None:
+    """Remove partial downloads (and their journals) that have not been touched for max_age seconds"""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        if not name.endswith(JOURNAL_SUFFIX):
+            continue
+        journal_path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(journal_path) >= cutoff:
+                continue
+            file_path = journal_path[:-len(JOURNAL_SUFFIX)]
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            os.remove(journal_path)
+            logger.info(f"Removed stale partial download {file_path}")
+        except OSError as e:
+            logger.warning(f"Failed to remove stale partial download {journal_path}: {str(e)}")
+
+
+@asynccontextmanager
+async def claim(file_path: str):
+    """Hold file_path, and the journal next to it, for one job at a time.
+
+    Jobs for the same share or the same title land on the same path; a
+    second job waits here until the first has finished with the file
+    instead of truncating it or writing into its journal mid-download.
+    """
+    key = os.path.abspath(file_path)
+    lock, users = _claims.get(key) or (asyncio.Lock(), 0)
+    _claims[key] = (lock, users + 1)
+    try:
+        if lock.locked():
+            logger.info(f"Waiting for another job to finish with {file_path}")
+        async with lock:
+            yield
+    finally:
+        lock, users = _claims[key]
+        if users == 1:
+            del _claims[key]
+        else:
+            _claims[key] = (lock, users - 1)
+
+
+async def _fetch_segment(session: aiohttp.ClientSession, url: str, file_path: str,
+                         segment: _Segment, counter: List[int], journal: Journal) -> None:
+    """Fetch one byte range into its offset of the preallocated file, resuming on retry"""
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            headers = {"Range": f"bytes={segment.position}-{segment.end}"}
+            async with session.get(url, headers=headers) as response:
+                if response.status == 200:
+                    raise RangeNotSupported("Server ignored the Range header")
+                if response.status != 206:
+                    raise DownloadError(f"Failed to download segment. Status: {response.status}")
+
+                # Unbuffered so the journal never claims bytes still sitting in a Python buffer
+                with open(file_path, 'r+b', buffering=0) as f:
+                    f.seek(segment.position)
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        # Never write past the end of the segment, even if the server overshoots
+                        chunk = chunk[:segment.end + 1 - segment.position]
+                        f.write(chunk)
+                        segment.position += len(chunk)
+                        counter[0] += len(chunk)
+                        journal.save()
+                        if segment.done:
+                            break
+
+            if segment.done:
+                return
+            raise DownloadError("Connection closed before the segment was complete")
+        except RangeNotSupported:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise DownloadError(
+                    f"Segment {segment.start}-{segment.end} failed after {SEGMENT_RETRIES} attempts: {str(e)}"
+                )
+            logger.warning(f"Segment {segment.start}-{segment.end} failed, retrying: {str(e)}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def _stream(session: aiohttp.ClientSession, url: str, file_path: str, counter: List[int]) -> None:
+    """Download the whole body over a single connection"""
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise DownloadError(f"Failed to download file. Status: {response.status}")
+
+        with open(file_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                f.write(chunk)
+                counter[0] += len(chunk)
+
+
+async def _report(progress: ProgressCallback, counter: List[int], total_size: int) -> None:
+    """Call the progress callback periodically until cancelled"""
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        try:
+            await progress(counter[0], total_size)
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {str(e)}")
+
+
+async def download(url: str, file_path: str, progress: Optional[ProgressCallback] = None,
+                   connections: int = DEFAULT_CONNECTIONS,
+                   session: Optional[aiohttp.ClientSession] = None) -> int:
+    """Download url to file_path over parallel Range requests, returning the size in bytes.
+
+    Progress is journaled next to file_path, so calling this again after a
+    failure or a restart continues where the previous attempt stopped.
+    Falls back to a single stream when the server does not support ranges.
+    Jobs that may share file_path with another hold claim(file_path) for as
+    long as they use the file.
+    """
+    if session is None:
+        session = http_client.get_session()
+
+    total_size, accepts_ranges, etag = await probe(session, url)
+    counter = [0]
+    reporter = asyncio.create_task(_report(progress, counter, total_size)) if progress else None
+
+    try:
+        if accepts_ranges and total_size:
+            journal = Journal.load(file_path, url, etag, total_size)
+            if journal:
+                logger.info(f"Resuming {file_path} from {sum(s.completed for s in journal.segments)} bytes")
+            else:
+                # Preallocate so every segment can write straight to its own offset
+                with open(file_path, 'wb') as f:
+                    f.truncate(total_size)
+                segments = [_Segment(start, end) for start, end in split_ranges(total_size, connections)]
+                journal = Journal(file_path, url, etag, total_size, segments)
+                journal.save(force=True)
+
+            counter[0] = sum(s.completed for s in journal.segments)
+            pending = [s for s in journal.segments if not s.done]
+            logger.info(f"Downloading {total_size} bytes over {len(pending)} connections")
+            tasks = [
+                asyncio.create_task(_fetch_segment(session, url, file_path, segment, counter, journal))
+                for segment in pending
+            ]
+            try:
+                await asyncio.gather(*tasks)
+                journal.remove()
+            except RangeNotSupported:
+                logger.warning("Server stopped honouring ranges, falling back to a single stream")
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                journal.remove()
+                counter[0] = 0
+                await _stream(session, url, file_path, counter)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                journal.save(force=True)
+                raise
+        else:
+            await _stream(session, url, file_path, counter)
+    finally:
+        if reporter:
+            reporter.cancel()
+
+    if progress:
+        try:
+            await progress(counter[0], total_size or counter[0])
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {str(e)}")
+    return counter[0]
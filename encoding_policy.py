@@ -0,0 +1,101 @@
+import logging
+import os
+from typing import NamedTuple, Optional
+
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+# Policy configuration (override through environment variables)
+CORES = os.cpu_count() or 1
+BASE_CRF = int(os.getenv("ENCODE_CRF", 23))  # Quality when the bot is idle; lower is better
+MAX_CRF_PENALTY = 4  # Most CRF points given up under heavy load
+LONG_VIDEO = 30 * 60  # Seconds after which a video is encoded one preset faster
+HD_SIDE = 720  # Shorter side above which a video is encoded one preset faster
+HIGH_RES_CAP = 1080  # Shorter side larger than this is scaled down
+LOADED_RES_CAP = 720  # Shorter side cap once the backlog is twice the worker count
+
+# libx264 presets from best compression to fastest
+PRESETS = ["slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+BASE_PRESET = "fast"
+
+
+class VideoInfo(NamedTuple):
+    width: int
+    height: int
+    duration: float
+    codec: str = ""
+    profile: str = ""
+    level: int = 0
+    pix_fmt: str = ""
+
+
+class EncodingSettings(NamedTuple):
+    preset: str = BASE_PRESET
+    crf: int = BASE_CRF
+    threads: int = 0  # 0 lets libx264 decide
+    max_side: Optional[int] = None  # Cap for the shorter side, None keeps the input size
+
+    def scale_filter(self, info: Optional[VideoInfo]) -> Optional[str]:
+        """Return the scale filter that enforces max_side, or None if no scaling is needed"""
+        if not self.max_side or not info or min(info.width, info.height) <= self.max_side:
+            return None
+        if info.width >= info.height:
+            return f"scale=-2:{self.max_side}"
+        return f"scale={self.max_side}:-2"
+
+
+async def probe_video(path: str) -> Optional[VideoInfo]:
+    """Return the displayed size, duration, codec and H.264 parameters of path's video stream"""
+    info = await media_probe.probe(path)
+    if not info or not info.width:
+        return None
+    return VideoInfo(info.width, info.height, info.duration, info.video_codec,
+                     info.video_profile, info.video_level, info.pix_fmt)
+
+
+def _faster(preset: str, steps: int) -> str:
+    return PRESETS[min(PRESETS.index(preset) + steps, len(PRESETS) - 1)]
+
+
+def choose_settings(info: Optional[VideoInfo], backlog: int, workers: int = CORES) -> EncodingSettings:
+    """Pick preset, CRF, threads and resolution cap for one encode.
+
+    backlog counts encodes running or waiting, this one included. When it
+    exceeds the worker count every encode trades some quality and size
+    for speed, so the queue drains instead of growing.
+    """
+    workers = max(1, workers)
+    load = backlog / workers
+    steps = 0
+    crf = BASE_CRF
+    max_side = None
+
+    if info:
+        short_side = min(info.width, info.height)
+        if short_side > HD_SIDE:
+            steps += 1
+        if short_side > HIGH_RES_CAP:
+            max_side = HIGH_RES_CAP
+        if info.duration > LONG_VIDEO:
+            steps += 1
+
+    if load > 1:
+        steps += 1
+        crf += min(MAX_CRF_PENALTY, int(load))
+    if load >= 2:
+        steps += 1
+        max_side = min(max_side or LOADED_RES_CAP, LOADED_RES_CAP)
+
+    # Split the cores between the encodes that run at the same time
+    threads = max(1, CORES // max(1, min(backlog, workers)))
+    return EncodingSettings(_faster(BASE_PRESET, steps), crf, threads, max_side)
+
+
+async def settings_for(path: str, backlog: int, workers: int = CORES):
+    """Probe path and choose settings for it; returns (settings, info)"""
+    info = await probe_video(path)
+    settings = choose_settings(info, backlog, workers)
+    described = f"{info.width}x{info.height}, {info.duration:.0f}s" if info else "not probed"
+    logger.info(f"Encoding {os.path.basename(path)} ({described}) with backlog {backlog}: {settings}")
+    return settings, info
@@ -0,0 +1,98 @@
+import logging
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+from metadata_cache import CACHE_DB
+
+logger = logging.getLogger(__name__)
+
+
+class CachedFile(NamedTuple):
+    """A file Telegram already stores, ready to be re-sent by file_id"""
+    file_id: str
+    thumb_file_id: Optional[str]
+    media_type: str  # "video" or "document"
+
+
+class FileIdCache:
+    """Persistent map from (share ID, file size) to the Telegram file_id of an earlier upload"""
+
+    def __init__(self, db_path: str = CACHE_DB):
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sent_files ("
+            "share_id TEXT NOT NULL, size TEXT NOT NULL, file_id TEXT NOT NULL, "
+            "thumb_file_id TEXT, media_type TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (share_id, size))"
+        )
+        self._db.commit()
+
+    def get(self, share_id: Optional[str], size: str = "") -> Optional[CachedFile]:
+        """Return the cached upload for a share, or None"""
+        row = None
+        if share_id:
+            row = self._db.execute(
+                "SELECT file_id, thumb_file_id, media_type FROM sent_files WHERE share_id = ? AND size = ?",
+                (share_id, size)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedFile(*row)
+
+    def put(self, share_id: Optional[str], size: str, sent_message) -> None:
+        """Remember the file_id Telegram returned for an uploaded video or document"""
+        media = getattr(sent_message, "video", None) or getattr(sent_message, "document", None)
+        if not share_id or media is None:
+            return
+        media_type = "video" if getattr(sent_message, "video", None) else "document"
+        thumbs = getattr(media, "thumbs", None)
+        thumb_file_id = thumbs[0].file_id if thumbs else None
+        self._db.execute(
+            "INSERT OR REPLACE INTO sent_files "
+            "(share_id, size, file_id, thumb_file_id, media_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (share_id, size, media.file_id, thumb_file_id, media_type, time.time())
+        )
+        self._db.commit()
+
+    def invalidate(self, share_id: Optional[str], size: str = "") -> None:
+        """Forget a cached upload Telegram no longer accepts"""
+        self._db.execute("DELETE FROM sent_files WHERE share_id = ? AND size = ?", (share_id, size))
+        self._db.commit()
+
+    async def send_cached(self, client, chat_id: int, share_id: Optional[str], size: str,
+                          caption: str, document_caption: Optional[str] = None):
+        """Re-send a previously uploaded file by file_id, returning the sent message or None on a miss"""
+        cached = self.get(share_id, size)
+        if cached is None:
+            return None
+        try:
+            if cached.media_type == "video":
+                return await client.send_video(
+                    chat_id=chat_id,
+                    video=cached.file_id,
+                    caption=caption,
+                    supports_streaming=True
+                )
+            return await client.send_document(
+                chat_id=chat_id,
+                document=cached.file_id,
+                caption=document_caption or caption
+            )
+        except Exception as e:
+            logger.warning(f"Cached file_id for {share_id} was rejected: {str(e)}")
+            self.invalidate(share_id, size)
+            return None
+
+    def stats(self) -> dict:
+        """Return hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (override through environment variables)
+POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))  # Total open connections
+POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 32))  # Segmented downloads share one CDN host
+DNS_CACHE_TTL = 300  # Seconds to keep resolved addresses
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle connection stays in the pool
+TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class PoolStats:
+    """Counters collected from aiohttp request tracing"""
+
+    def __init__(self):
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.queued = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def as_dict(self, connector: Optional[aiohttp.BaseConnector] = None) -> dict:
+        connections = self.created + self.reused
+        stats = {
+            "requests": self.requests,
+            "connections_created": self.created,
+            "connections_reused": self.reused,
+            "reuse_ratio": self.reused / connections if connections else 0.0,
+            "queued": self.queued,
+            "queue_wait_avg": self.queue_wait_total / self.queued if self.queued else 0.0,
+            "queue_wait_max": self.queue_wait_max,
+        }
+        if connector is not None:
+            # aiohttp doesn't expose these publicly; tolerate their absence
+            stats["open_connections"] = len(getattr(connector, "_acquired", ()))
+            stats["idle_connections"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+async def _on_request_start(session, ctx, params):
+    pool_stats.requests += 1
+
+
+async def _on_queued_start(session, ctx, params):
+    ctx.queued_at = time.monotonic()
+
+
+async def _on_queued_end(session, ctx, params):
+    wait = time.monotonic() - getattr(ctx, "queued_at", time.monotonic())
+    pool_stats.queued += 1
+    pool_stats.queue_wait_total += wait
+    pool_stats.queue_wait_max = max(pool_stats.queue_wait_max, wait)
+
+
+async def _on_connection_create_end(session, ctx, params):
+    pool_stats.created += 1
+
+
+async def _on_connection_reuse(session, ctx, params):
+    pool_stats.reused += 1
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_connection_queued_start.append(_on_queued_start)
+    trace.on_connection_queued_end.append(_on_queued_end)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_connection_reuseconn.append(_on_connection_reuse)
+    return trace
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it on first use inside the running loop"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=TIMEOUT,
+            trace_configs=[_trace_config()],
+        )
+    return _session
+
+
+def stats() -> dict:
+    """Return connection pool statistics for the shared session"""
+    connector = _session.connector if _session is not None and not _session.closed else None
+    return pool_stats.as_dict(connector)
+
+
+async def start() -> None:
+    """Open the shared session"""
+    get_session()
+
+
+async def close() -> None:
+    """Close the shared session and every pooled connection"""
+    global _session
+    if _session is not None and not _session.closed:
+        logger.info(f"HTTP pool stats: {stats()}")
+        await _session.close()
+        # Give SSL transports a moment to shut down cleanly
+        await asyncio.sleep(0.25)
+    _session = None
+
+
+def run(app) -> None:
+    """Run a Pyrogram client like app.run(), opening the shared session before start and closing it after stop"""
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(start())
+    try:
+        app.run()
+    finally:
+        loop.run_until_complete(close())
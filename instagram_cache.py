@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+from instagram_links import shortcode
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (override through environment variables)
+FRESH_TTL = int(os.getenv("INSTAGRAM_CACHE_TTL", 120))  # Seconds a resolved post is served without asking the API
+STALE_TTL = int(os.getenv("INSTAGRAM_CACHE_STALE", 900))  # Seconds after that it is served while being refreshed
+MEMORY_ENTRIES = 2048  # Posts kept in the LRU
+EXPIRY_MARGIN = 120  # Stop serving an entry this many seconds before its CDN links expire
+
+Fetcher = Callable[[str], Awaitable[dict]]
+
+
+def _urls(value) -> Iterator[str]:
+    if isinstance(value, str):
+        if value.startswith("http"):
+            yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _urls(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _urls(item)
+
+
+def links_expiry(info: dict) -> Optional[float]:
+    """Return when the first signed Instagram CDN link in info expires (the hex oe parameter)"""
+    expiries = []
+    for url in _urls(info):
+        oe = parse_qs(urlparse(url).query).get("oe", [""])[0]
+        try:
+            expiries.append(float(int(oe, 16)))
+        except ValueError:
+            continue
+    return min(expiries, default=None)
+
+
+class ResolverCache:
+    """Short-lived cache of Instagram API answers keyed by shortcode.
+
+    Fresh entries are returned as they are. Stale ones are returned at once
+    while a background call refreshes them, and concurrent misses for the
+    same shortcode share a single upstream call.
+    """
+
+    def __init__(self, fresh_ttl: int = FRESH_TTL, stale_ttl: int = STALE_TTL,
+                 max_entries: int = MEMORY_ENTRIES):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (fresh_until, usable_until, info)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshes: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _put(self, key: str, info: dict) -> None:
+        now = time.time()
+        usable_until = now + self.fresh_ttl + self.stale_ttl
+        expiry = links_expiry(info)
+        if expiry is not None:
+            usable_until = min(usable_until, expiry - EXPIRY_MARGIN)
+        if usable_until <= now:
+            return
+        self._entries[key] = (min(now + self.fresh_ttl, usable_until), usable_until, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, key: str, url: str, fetch: Fetcher) -> dict:
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            # The call runs in its own task, so cancelling the caller that started it doesn't cancel it
+            inflight = asyncio.ensure_future(self._load(key, url, fetch))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda task: self._settled(key, task))
+        # Shield so one impatient caller can't cancel the lookup for everyone else
+        return await asyncio.shield(inflight)
+
+    async def _load(self, key: str, url: str, fetch: Fetcher) -> dict:
+        info = await fetch(url)
+        self._put(key, info)
+        return info
+
+    def _settled(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieve the exception so it isn't reported as never retrieved when every caller gave up
+            task.exception()
+
+    async def _refresh(self, key: str, url: str, fetch: Fetcher) -> None:
+        try:
+            await self._fetch(key, url, fetch)
+        except Exception as e:
+            # Keep serving the stale answer until it runs out
+            logger.warning(f"Background refresh of {key} failed: {str(e)}")
+
+    async def get_or_fetch(self, url: str, fetch: Fetcher) -> dict:
+        """Return the API answer for url from cache, or call fetch(url) once for all concurrent callers"""
+        key = shortcode(url) or url
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            fresh_until, usable_until, info = entry
+            if now < fresh_until:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return info
+            if now < usable_until:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._inflight:
+                    task = asyncio.ensure_future(self._refresh(key, url, fetch))
+                    self._refreshes.add(task)
+                    task.add_done_callback(self._refreshes.discard)
+                return info
+            del self._entries[key]
+
+        if key in self._inflight:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self._fetch(key, url, fetch)
+
+    def invalidate(self, url: str) -> None:
+        """Forget a post, e.g. after one of its CDN links was rejected"""
+        self._entries.pop(shortcode(url) or url, None)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
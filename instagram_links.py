@@ -0,0 +1,58 @@
+import os
+import re
+from typing import List, Optional
+from urllib.parse import urlparse
+
+# Extractor configuration (override through environment variables)
+MAX_LINKS = int(os.getenv("INSTAGRAM_MAX_LINKS", 5))  # Links handled from one message
+
+# Post, reel, IGTV and story URLs, with or without scheme, www/m prefix or a username segment;
+# the lookbehind stops look-alike hosts such as fakeinstagram.com matching on their instagram.com suffix
+URL_REGEX = re.compile(
+    r'(?<![\w.-])(?:https?://)?(?:www\.|m\.)?(?:instagram\.com|instagr\.am)'
+    r'(?:/[A-Za-z0-9_.]+)?'
+    r'/(?:(?P<kind>p|reels?|tv)/(?P<code>[A-Za-z0-9_-]+)|stories/(?P<user>[A-Za-z0-9_.]+)/(?P<story>\d+))'
+    r'[^\s<>"\']*',
+    re.IGNORECASE
+)
+SHORTCODE_REGEX = re.compile(r'/(?:p|reels?|tv)/([A-Za-z0-9_-]+)|/stories/[^/]+/(\d+)')
+
+
+def shortcode(url: str) -> Optional[str]:
+    """Return the post, reel or story ID of an Instagram URL, identical across link styles"""
+    match = SHORTCODE_REGEX.search(urlparse(url).path)
+    if not match:
+        return None
+    return match.group(1) or f"story:{match.group(2)}"
+
+
+def _canonical(match: "re.Match") -> str:
+    if match.group("story"):
+        return f"https://www.instagram.com/stories/{match.group('user')}/{match.group('story')}/"
+    # /reels/ and /username/reel/ are the same reel; query strings only carry igsh and utm tracking
+    kind = "reel" if match.group("kind").lower().startswith("reel") else match.group("kind").lower()
+    return f"https://www.instagram.com/{kind}/{match.group('code')}/"
+
+
+def canonical_url(url: str) -> Optional[str]:
+    """Return the canonical form of an Instagram post, reel or story URL, or None"""
+    match = URL_REGEX.search(url)
+    return _canonical(match) if match else None
+
+
+def extract_links(text: Optional[str], limit: int = MAX_LINKS) -> List[str]:
+    """Return the canonical Instagram URLs in text, deduplicated and in order, at most limit of them"""
+    if not text or "instagr" not in text:
+        return []
+    links: List[str] = []
+    seen = set()
+    for match in URL_REGEX.finditer(text):
+        url = _canonical(match)
+        key = shortcode(url)
+        if key in seen:
+            continue
+        seen.add(key)
+        links.append(url)
+        if len(links) >= limit:
+            break
+    return links
@@ -1,9 +1,14 @@
 import os
-import io
-import requests
+import asyncio
+import logging
+from typing import List
 from dotenv import load_dotenv
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo
+import http_client
+import spooled_buffer
+from instagram_cache import ResolverCache
+from instagram_links import extract_links
 
 # Load secrets from .env
 load_dotenv()
@@ -13,6 +18,13 @@ API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 LOG_CHANNEL = int(os.getenv("LOG_CHANNEL"))
 BOT_USERNAME = os.getenv("BOT_USERNAME")  # without @
+FETCH_CONCURRENCY = int(os.getenv("INSTAGRAM_FETCH_CONCURRENCY", 4))  # Carousel items downloaded at once
+MEDIA_GROUP_SIZE = 10  # Telegram's limit per media group
+
+logger = logging.getLogger(__name__)
+
+# Recent API answers by shortcode, so a reel forwarded to many groups is resolved once
+post_cache = ResolverCache()
 
 # Initialize bot
 bot = Client("instagram_downloader_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
@@ -28,79 +40,141 @@ async def start_command(client: Client, message: Message):
         quote=True
     )
 
-# Function to process Instagram links
-async def process_instagram_link(message: Message, url: str):
-    processing_msg = await message.reply("🔍 Processing your Instagram link...")
-
+async def fetch_media(index: int, media: dict, semaphore: asyncio.Semaphore):
+    """Download one carousel item; large videos spill to a temp file instead of staying in RAM"""
+    async with semaphore:
+        return await spooled_buffer.download(
+            http_client.get_session(), media["url"], f"instagram_media_{index}.{media.get('extension')}"
+        )
+
+def as_input_media(media: dict, file, caption: str):
+    """Wrap a downloaded item for send_media_group"""
+    if media.get("type") == "video":
+        return InputMediaVideo(file, caption=caption)
+    return InputMediaPhoto(file, caption=caption)
+
+class MediaNotFound(Exception):
+    """The API answered but has no media for the link"""
+    pass
+
+async def fetch_post(url: str) -> dict:
+    """Ask the API for a post's media; error answers raise so they aren't cached"""
     api_url = f"https://instagram-media-downloader-662h16y9n-narendar761s-projects.vercel.app/api/instagram?url={url}"
-    try:
-        response = requests.get(api_url)
-        data = response.json()
-    except Exception:
-        await processing_msg.edit("⚠️ Failed to fetch data from the API.")
-        return
-
+    async with http_client.get_session().get(api_url) as response:
+        data = await response.json(content_type=None)
     if data.get("error"):
-        await processing_msg.edit("❌ Couldn't download media. Try a different link.")
-        return
-
-    medias = data.get("medias", [])
+        raise MediaNotFound(str(data["error"]))
+    return data
+
+async def report(message: Message, processing_msg: Message, prefix: str, text: str) -> None:
+    """Show a per-link problem; batches reply so one link's error isn't overwritten by the next link's progress"""
+    if prefix:
+        await message.reply(prefix + text)
+    else:
+        await processing_msg.edit(text)
+
+async def send_post(message: Message, processing_msg: Message, url: str, data: dict, prefix: str = "") -> int:
+    """Download one post's media and send it in order; returns how many files were found"""
+    medias = [media for media in data.get("medias", []) if media.get("url") and media.get("type") in ("video", "image")]
     if not medias:
-        await processing_msg.edit("⚠️ No downloadable media found.")
-        return
+        await report(message, processing_msg, prefix, "⚠️ No downloadable media found.")
+        return 0
 
-    await processing_msg.edit(f"📥 Found {len(medias)} media file(s). Downloading...")
+    await processing_msg.edit(f"{prefix}📥 Found {len(medias)} media file(s). Downloading...")
 
-    for i, media in enumerate(medias, start=1):
-        media_url = media.get("url")
-        media_type = media.get("type")
-        extension = media.get("extension")
-
-        if not media_url:
-            continue
+    # Fetch every item at once (bounded), so a carousel takes about as long as its slowest item
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    results = await asyncio.gather(
+        *(fetch_media(i, media, semaphore) for i, media in enumerate(medias, start=1)),
+        return_exceptions=True
+    )
 
+    # Keep the carousel order; report items that failed instead of dropping them silently
+    downloaded = []
+    for i, (media, result) in enumerate(zip(medias, results), start=1):
+        if isinstance(result, Exception):
+            logger.warning(f"Instagram media {i} failed: {result}")
+            await message.reply(f"{prefix}❌ Failed to download media {i}: {result}")
+        else:
+            downloaded.append((media, result))
+    if len(downloaded) < len(medias):
+        # The signed CDN links may have expired; resolve the post again next time
+        post_cache.invalidate(url)
+
+    caption = f"🎬 From Instagram\n🤖 Powered by @{BOT_USERNAME}"
+    if downloaded:
+        await processing_msg.edit(f"{prefix}📤 Uploading {len(downloaded)} media file(s)...")
         try:
-            download_note = await message.reply(f"📥 Downloading media {i}/{len(medias)}...")
-            resp = requests.get(media_url, stream=True)
-            resp.raise_for_status()
-
-            file = io.BytesIO(resp.content)
-            file.name = f"instagram_media_{i}.{extension}"
-
-            caption = f"🎬 From Instagram\n🤖 Powered by @{BOT_USERNAME}"
-
-            upload_note = await download_note.edit(f"📤 Uploading media {i}/{len(medias)}...")
+            for start in range(0, len(downloaded), MEDIA_GROUP_SIZE):
+                group = downloaded[start:start + MEDIA_GROUP_SIZE]
+                if len(group) == 1:
+                    # A media group needs at least two items
+                    media, file = group[0]
+                    if media["type"] == "video":
+                        await message.reply_video(file, caption=caption)
+                    else:
+                        await message.reply_photo(file, caption=caption)
+                    continue
+                # Telegram shows the first item's caption for the whole album
+                await message.reply_media_group([
+                    as_input_media(media, file, caption if start + n == 0 else "")
+                    for n, (media, file) in enumerate(group)
+                ])
+        except Exception as e:
+            await message.reply(f"{prefix}❌ Failed to upload media: {e}")
+        finally:
+            # Release memory and temp files now rather than whenever the buffers are collected
+            for _, file in downloaded:
+                file.close()
+    return len(medias)
 
-            if media_type == "video":
-                await message.reply_video(file, caption=caption)
-            elif media_type == "image":
-                await message.reply_photo(file, caption=caption)
+# Function to process Instagram links
+async def process_instagram_links(message: Message, urls: List[str]):
+    batch = len(urls) > 1
+    processing_msg = await message.reply(
+        f"🔍 Processing {len(urls)} Instagram links..." if batch
+        else "🔍 Processing your Instagram link..."
+    )
 
-            await upload_note.delete()
-        except Exception as e:
-            await message.reply(f"❌ Failed to upload media {i}: {e}")
+    # Resolve every link at once; the cache merges repeats and they share the pooled connections
+    answers = await asyncio.gather(
+        *(post_cache.get_or_fetch(url, fetch_post) for url in urls),
+        return_exceptions=True
+    )
 
+    total_files = 0
+    for number, (url, data) in enumerate(zip(urls, answers), start=1):
+        prefix = f"[{number}/{len(urls)}] " if batch else ""
+        if isinstance(data, MediaNotFound):
+            await report(message, processing_msg, prefix, "❌ Couldn't download media. Try a different link.")
+        elif isinstance(data, Exception):
+            logger.warning(f"Instagram API failed for {url}: {data}")
+            await report(message, processing_msg, prefix, "⚠️ Failed to fetch data from the API.")
+        else:
+            total_files += await send_post(message, processing_msg, url, data, prefix)
+
+    if not total_files:
+        return
     await processing_msg.edit("✅ All media sent!")
 
     # Log to channel
     chat_title = message.chat.title if message.chat.type != "private" else "Private"
+    links = "\n".join(urls)
     await bot.send_message(
         LOG_CHANNEL,
         f"📥 Used by: [{message.from_user.first_name}](tg://user?id={message.from_user.id})\n"
         f"🏷 Chat: {chat_title}\n"
-        f"🔗 Link: {url}\n"
-        f"📦 Files: {len(medias)}"
+        f"🔗 Link: {links}\n"
+        f"📦 Files: {total_files}"
     )
 
 # Handler: Watch for Instagram links in all messages (private & group)
 @bot.on_message(filters.text & (filters.group | filters.private))
 async def catch_instagram_links(client: Client, message: Message):
-    text = message.text.strip()
-
-    # Match basic Instagram link types
-    if "instagram.com/" in text:
-        # Optional: you could extract the exact URL using regex here
-        await process_instagram_link(message, text)
+    # Only real post/reel/story URLs, canonicalized and deduplicated, reach the API
+    urls = extract_links(message.text)
+    if urls:
+        await process_instagram_links(message, urls)
 
-bot.run()
+http_client.run(bot)
       
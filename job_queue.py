@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Worker configuration (override through environment variables)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 3))  # Concurrent downloads across all users
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 2))  # Concurrent uploads across all users
+PER_USER_JOBS = int(os.getenv("PER_USER_JOBS", 1))  # Concurrent jobs of one kind per user
+POSITION_REFRESH = 5  # Seconds between queue position updates
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class FairScheduler:
+    """Bounded pool of job slots handed out round-robin across users.
+
+    A user never holds more than per_user slots, and waiting users take
+    turns, so one user queueing many jobs cannot starve the others.
+    """
+
+    def __init__(self, workers: int, per_user: int = PER_USER_JOBS):
+        self.workers = workers
+        self.per_user = per_user
+        self._active = 0
+        self._active_by_user: Dict[Hashable, int] = defaultdict(int)
+        # Users with waiting jobs, in round-robin order
+        self._waiting: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def position(self, user_id: Hashable, future: asyncio.Future) -> int:
+        """Return the 1-based place of a waiting job if users keep taking turns"""
+        waiters = self._waiting.get(user_id)
+        if not waiters or future not in waiters:
+            return 0
+        index = waiters.index(future)
+        # This user's own earlier jobs, plus one turn per round for every other user:
+        # users ahead in the rotation get index + 1 turns first, users behind get index
+        ahead = index
+        passed = False
+        for other_id, other in self._waiting.items():
+            if other_id == user_id:
+                passed = True
+            else:
+                ahead += min(len(other), index if passed else index + 1)
+        return ahead + 1
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting jobs, one user at a time"""
+        while self._active < self.workers:
+            for user_id, waiters in self._waiting.items():
+                if self._active_by_user[user_id] < self.per_user:
+                    break
+            else:
+                return  # Everyone waiting is at their per-user limit
+
+            future = waiters.popleft()
+            if not waiters:
+                del self._waiting[user_id]
+            else:
+                # Move to the back of the rotation
+                self._waiting.move_to_end(user_id)
+            if future.done():
+                continue
+            self._active += 1
+            self._active_by_user[user_id] += 1
+            future.set_result(None)
+
+    def _release(self, user_id: Hashable) -> None:
+        self._active -= 1
+        self._active_by_user[user_id] -= 1
+        if not self._active_by_user[user_id]:
+            del self._active_by_user[user_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: Hashable, on_position: Optional[PositionCallback] = None):
+        """Wait for a free slot for user_id, reporting the queue position while waiting"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        self._dispatch()
+
+        try:
+            last_position = None
+            while not future.done():
+                position = self.position(user_id, future)
+                if on_position and position and position != last_position:
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.warning(f"Queue position callback failed: {str(e)}")
+                    last_position = position
+                await asyncio.wait({future}, timeout=POSITION_REFRESH)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up
+                self._release(user_id)
+            else:
+                future.cancel()
+                waiters = self._waiting.get(user_id)
+                if waiters and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiting[user_id]
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+import mp4_faststart
+
+logger = logging.getLogger(__name__)
+
+# Probe configuration (override through environment variables)
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE = os.getenv("FFPROBE_BINARY", "ffprobe")
+CACHE_ENTRIES = 256  # Probe results kept in memory
+PROBE_TIMEOUT = 30  # Seconds before a stuck ffprobe is killed
+FASTSTART = os.getenv("FASTSTART", "1") == "1"  # Move moov to the front of MP4s before upload
+
+MP4_FORMATS = ("mov", "mp4", "m4a", "3gp", "3g2", "mj2")
+
+
+class MediaInfo(NamedTuple):
+    duration: float = 0.0
+    width: int = 0  # As displayed, i.e. after rotation
+    height: int = 0
+    rotation: int = 0
+    video_codec: str = ""
+    audio_codec: str = ""
+    video_profile: str = ""  # As ffprobe names it, e.g. "High"
+    video_level: int = 0  # ffprobe's level_idc, e.g. 40 for 4.0
+    pix_fmt: str = ""
+    format_name: str = ""
+
+    @property
+    def is_mp4(self) -> bool:
+        return any(name in MP4_FORMATS for name in self.format_name.split(","))
+
+    def video_kwargs(self) -> dict:
+        """Arguments for Pyrogram's send_video"""
+        return {"duration": int(self.duration), "width": self.width, "height": self.height}
+
+
+# (path, size, mtime) -> MediaInfo, so the same file is probed once
+_cache: "OrderedDict[Tuple[str, int, float], MediaInfo]" = OrderedDict()
+
+
+def _rotation(stream: dict) -> int:
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(side_data["rotation"]) % 360
+    rotate = stream.get("tags", {}).get("rotate")
+    return int(rotate) % 360 if rotate else 0
+
+
+def _parse(data: dict) -> MediaInfo:
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    rotation = _rotation(video)
+    width, height = int(video.get("width", 0)), int(video.get("height", 0))
+    if rotation in (90, 270):
+        width, height = height, width
+    fmt = data.get("format", {})
+    return MediaInfo(
+        duration=float(fmt.get("duration", 0) or 0),
+        width=width,
+        height=height,
+        rotation=rotation,
+        video_codec=video.get("codec_name", ""),
+        audio_codec=audio.get("codec_name", ""),
+        video_profile=video.get("profile", ""),
+        video_level=int(video.get("level", 0) or 0),
+        pix_fmt=video.get("pix_fmt", ""),
+        format_name=fmt.get("format_name", ""),
+    )
+
+
+async def probe(path: str) -> Optional[MediaInfo]:
+    """Read container and stream info with one ffprobe call, cached per file version"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    info = _cache.get(key)
+    if info is not None:
+        _cache.move_to_end(key)
+        return info
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE, "-v", "error",
+            "-show_entries", "format=duration,format_name:stream=codec_type,codec_name,profile,level,pix_fmt,width,height"
+                             ":stream_tags=rotate:stream_side_data=rotation",
+            "-of", "json", path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        info = _parse(json.loads(stdout or b"{}"))
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        logger.warning(f"ffprobe failed for {path}: {str(e)}")
+        return None
+
+    _cache[key] = info
+    while len(_cache) > CACHE_ENTRIES:
+        _cache.popitem(last=False)
+    return info
+
+
+async def faststart(path: str) -> bool:
+    """Move the moov box to the front with a stream-copy remux; returns True if the file was rewritten"""
+    temp_path = path + ".faststart.mp4"
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+        "-i", path, "-map", "0", "-c", "copy", "-movflags", "+faststart", temp_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    finally:
+        if process.returncode != 0 and os.path.exists(temp_path):
+            os.remove(temp_path)
+    if process.returncode != 0:
+        logger.warning(f"Faststart remux of {path} failed: {stderr.decode(errors='replace').strip()}")
+        return False
+    os.replace(temp_path, path)
+    return True
+
+
+async def optimize_for_streaming(path: str) -> bool:
+    """Put an MP4's moov in front of its media so Telegram can stream it; returns True if rewritten.
+
+    Files already laid out for streaming are left untouched. The rewrite
+    copies the file in bounded chunks; ffmpeg is only used for layouts
+    the in-place relocation can't handle.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        relocated = await loop.run_in_executor(None, mp4_faststart.relocate_moov, path)
+    except mp4_faststart.UnsupportedLayout as e:
+        logger.info(f"Remuxing {os.path.basename(path)} with ffmpeg: {str(e)}")
+        return await faststart(path)
+    except (OSError, struct.error) as e:
+        logger.warning(f"Couldn't move moov of {path}: {str(e)}")
+        return False
+    if relocated:
+        logger.info(f"Moved moov to the front of {os.path.basename(path)}")
+    return relocated
+
+
+async def prepare_video(path: str) -> MediaInfo:
+    """Probe a downloaded video and make an MP4 streamable before it is sent.
+
+    Always returns a MediaInfo; fields stay 0 when the file can't be probed.
+    """
+    info = await probe(path)
+    if info is None:
+        return MediaInfo()
+    if FASTSTART and info.is_mp4:
+        await optimize_for_streaming(path)
+    return info
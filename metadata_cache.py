@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (override through environment variables)
+CACHE_DB = os.getenv("CACHE_DB", "cache.db")
+MEMORY_ENTRIES = 1024  # Share IDs kept in the in-memory LRU tier
+DEFAULT_TTL = 3600  # Seconds to trust an entry whose direct link carries no expiry
+EXPIRY_MARGIN = 300  # Drop entries this many seconds before the direct link expires
+
+DURATION_REGEX = re.compile(r'^(\d+)([smhd]?)$')
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+Fetcher = Callable[[str], Awaitable[dict]]
+
+
+def share_id(link: str) -> Optional[str]:
+    """Return the share ID of a TeraBox link, identical across mirror domains and link styles"""
+    parsed = urlparse(link)
+    surl = parse_qs(parsed.query).get("surl")
+    if surl:
+        return surl[0]
+    parts = [part for part in parsed.path.split("/") if part]
+    if len(parts) >= 2 and parts[0] in ("s", "sharing"):
+        # /s/1AbC and /sharing/link?surl=AbC point at the same share
+        return parts[1][1:] if parts[0] == "s" and parts[1].startswith("1") else parts[1]
+    return None
+
+
+def link_expiry(download_link: Optional[str], now: float) -> Optional[float]:
+    """Return the epoch time a signed direct link stops working, if the link says so"""
+    if not download_link:
+        return None
+    params = parse_qs(urlparse(download_link).query)
+    for key in ("x-expires", "Expires", "expires"):
+        value = params.get(key, [""])[0]
+        match = DURATION_REGEX.match(value)
+        if not match:
+            continue
+        amount, unit = int(match.group(1)), match.group(2)
+        if not unit and amount > 1_000_000_000:
+            return float(amount)  # Absolute epoch timestamp
+        # Relative lifetime such as expires=8h, counted from when the link was signed
+        signed_at = params.get("dstime", [""])[0]
+        start = float(signed_at) if signed_at.isdigit() else now
+        return start + amount * DURATION_UNITS[unit]
+    return None
+
+
+class MetadataCache:
+    """TTL cache of get_file_info results with an LRU memory tier and a SQLite tier.
+
+    Concurrent lookups for the same share ID share a single upstream call.
+    """
+
+    def __init__(self, db_path: str = CACHE_DB, max_entries: int = MEMORY_ENTRIES,
+                 default_ttl: int = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_info ("
+            "share_id TEXT PRIMARY KEY, info TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM file_info WHERE expires_at <= ?", (time.time(),))
+        self._db.commit()
+
+    def _expires_at(self, info: dict, now: float) -> float:
+        expires_at = now + self.default_ttl
+        expiry = link_expiry(info.get("🔽 Direct Download Link"), now)
+        if expiry is not None:
+            expires_at = min(expires_at, expiry - EXPIRY_MARGIN)
+        return expires_at
+
+    def _remember(self, key: str, info: dict, expires_at: float) -> None:
+        self._memory[key] = (expires_at, info)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return a fresh cached entry for a share ID, or None"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                return entry[1]
+            del self._memory[key]
+
+        row = self._db.execute(
+            "SELECT info, expires_at FROM file_info WHERE share_id = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._db.execute("DELETE FROM file_info WHERE share_id = ?", (key,))
+            self._db.commit()
+            return None
+        info = json.loads(row[0])
+        self._remember(key, info, row[1])
+        return info
+
+    def put(self, key: str, info: dict) -> None:
+        """Store an entry in both tiers unless its direct link is about to expire"""
+        now = time.time()
+        expires_at = self._expires_at(info, now)
+        if expires_at <= now:
+            return
+        self._remember(key, info, expires_at)
+        self._db.execute(
+            "INSERT OR REPLACE INTO file_info (share_id, info, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(info), expires_at)
+        )
+        self._db.commit()
+
+    def invalidate(self, link: str) -> None:
+        """Forget a share, e.g. after its direct link was rejected"""
+        key = share_id(link) or link
+        self._memory.pop(key, None)
+        self._db.execute("DELETE FROM file_info WHERE share_id = ?", (key,))
+        self._db.commit()
+
+    async def get_or_fetch(self, link: str, fetch: Fetcher) -> dict:
+        """Return file info for link from cache, or call fetch(link) once for all concurrent callers"""
+        key = share_id(link) or link
+        info = self.get(key)
+        if info is not None:
+            self.hits += 1
+            return info
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # The lookup runs in its own task, so cancelling the caller that started it doesn't cancel it
+            inflight = asyncio.ensure_future(self._fetch(key, link, fetch))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda task: self._settled(key, task))
+        # Shield so one impatient caller can't cancel the lookup for everyone else
+        return await asyncio.shield(inflight)
+
+    async def _fetch(self, key: str, link: str, fetch: Fetcher) -> dict:
+        info = await fetch(link)
+        self.put(key, info)
+        return info
+
+    def _settled(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieve the exception so it isn't reported as never retrieved when every caller gave up
+            task.exception()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
@@ -0,0 +1,131 @@
+import logging
+import os
+import struct
+from typing import BinaryIO, Iterator, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Relocation configuration (override through environment variables)
+COPY_CHUNK = 4 * 1024 * 1024  # Bytes copied at a time, so memory stays flat for multi-GB files
+MAX_MOOV_SIZE = int(os.getenv("FASTSTART_MAX_MOOV", 64 * 1024 * 1024))  # Largest moov patched in memory
+
+# Boxes inside moov that hold other boxes on the way to the chunk offset tables
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+class UnsupportedLayout(Exception):
+    """The file can't be rewritten here; a full remux is needed"""
+
+
+class Box(NamedTuple):
+    type: bytes
+    offset: int
+    size: int
+    header_size: int
+
+
+def top_level_boxes(f: BinaryIO) -> Iterator[Box]:
+    """Yield the top-level boxes of an ISO media file, reading headers only"""
+    file_size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise UnsupportedLayout(f"Corrupt {box_type!r} box at {offset}")
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def _patch_offsets(moov: bytearray, start: int, end: int, shift) -> None:
+    """Rewrite every stco/co64 entry in moov[start:end] with shift(offset)"""
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", moov, position)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", moov, position + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            raise UnsupportedLayout(f"Corrupt {box_type!r} box inside moov")
+        body = position + header_size
+
+        if box_type in CONTAINERS:
+            _patch_offsets(moov, body, position + size, shift)
+        elif box_type == b"cmov":
+            raise UnsupportedLayout("Compressed moov")
+        elif box_type in (b"stco", b"co64"):
+            entry_format = ">I" if box_type == b"stco" else ">Q"
+            entry_size = struct.calcsize(entry_format)
+            count = struct.unpack_from(">I", moov, body + 4)[0]  # After version and flags
+            for index in range(count):
+                entry = body + 8 + index * entry_size
+                offset = shift(struct.unpack_from(entry_format, moov, entry)[0])
+                if box_type == b"stco" and offset > 0xFFFFFFFF:
+                    raise UnsupportedLayout("Chunk offsets no longer fit in stco")
+                struct.pack_into(entry_format, moov, entry, offset)
+        position += size
+
+
+def _copy(source: BinaryIO, target: BinaryIO, start: int, length: int) -> None:
+    source.seek(start)
+    while length > 0:
+        chunk = source.read(min(COPY_CHUNK, length))
+        if not chunk:
+            raise UnsupportedLayout("File ended early")
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def relocate_moov(path: str) -> bool:
+    """Move an MP4's moov box in front of its media data without re-encoding.
+
+    Only moov is held in memory (at most MAX_MOOV_SIZE); the rest is copied
+    in COPY_CHUNK pieces to a temporary file that then replaces path.
+    Returns False if moov already comes first; raises UnsupportedLayout for
+    files that need ffmpeg.
+    """
+    with open(path, 'rb') as source:
+        boxes = list(top_level_boxes(source))
+        moov = next((box for box in boxes if box.type == b"moov"), None)
+        first_mdat = next((box for box in boxes if box.type == b"mdat"), None)
+        if moov is None or first_mdat is None:
+            raise UnsupportedLayout("No moov or mdat box")
+        if moov.offset < first_mdat.offset:
+            return False
+        if moov.size > MAX_MOOV_SIZE:
+            raise UnsupportedLayout(f"moov is {moov.size} bytes")
+
+        source.seek(moov.offset)
+        data = bytearray(source.read(moov.size))
+        insert_at = first_mdat.offset
+        moov_end = moov.offset + moov.size
+
+        def shift(offset: int) -> int:
+            # Everything between the insertion point and the old moov moves down by its size
+            return offset + moov.size if insert_at <= offset < moov.offset else offset
+
+        _patch_offsets(data, moov.header_size, moov.size, shift)
+
+        temp_path = path + ".faststart.tmp"
+        try:
+            with open(temp_path, 'wb') as target:
+                _copy(source, target, 0, insert_at)
+                target.write(data)
+                _copy(source, target, insert_at, moov.offset - insert_at)
+                _copy(source, target, moov_end, os.fstat(source.fileno()).st_size - moov_end)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    os.replace(temp_path, path)
+    return True
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (override through environment variables)
+OVERLAY_DIR = os.getenv("OVERLAY_DIR", "overlays")
+MEMORY_ENTRIES = 256  # Overlays whose paths are kept in the in-memory LRU tier
+DISK_ENTRIES = int(os.getenv("OVERLAY_DISK_ENTRIES", 2048))  # PNGs kept on disk before the oldest are removed
+PADDING = 2  # Transparent pixels around the text so strokes are not clipped
+
+
+def overlay_key(text: str, style) -> str:
+    """Return the cache key of a watermark; position is left out as it doesn't change the pixels"""
+    fields = (text, style.font_file, style.font_size, style.color, round(style.opacity, 3),
+              style.stroke_color, style.stroke_width)
+    return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+
+def _load_font(style):
+    if style.font_file and os.path.exists(style.font_file):
+        return ImageFont.truetype(style.font_file, style.font_size)
+    try:
+        return ImageFont.load_default(size=style.font_size)
+    except TypeError:
+        # Pillow before 10.1 has no sized default font
+        return ImageFont.load_default()
+
+
+def render_overlay(text: str, style, path: str) -> None:
+    """Rasterize text in style to a tightly cropped transparent PNG at path"""
+    font = _load_font(style)
+    alpha = max(0, min(255, int(style.opacity * 255)))
+    stroke_width = style.stroke_width if style.stroke_color else 0
+
+    left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox(
+        (0, 0), text, font=font, stroke_width=stroke_width
+    )
+    size = (right - left + 2 * PADDING, bottom - top + 2 * PADDING)
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    fill = ImageColor.getrgb(style.color)[:3] + (alpha,)
+    stroke_fill = ImageColor.getrgb(style.stroke_color)[:3] + (alpha,) if stroke_width else None
+    draw.text((PADDING - left, PADDING - top), text, font=font, fill=fill,
+              stroke_width=stroke_width, stroke_fill=stroke_fill)
+
+    temp_path = path + ".tmp"
+    image.save(temp_path, "PNG")
+    os.replace(temp_path, path)
+
+
+class OverlayCache:
+    """Pre-rendered watermark PNGs with an LRU memory tier and a disk tier.
+
+    Each text/style combination is rasterized once; encodes then overlay
+    the PNG instead of laying out text on every frame. Concurrent requests
+    for the same overlay share a single render.
+    """
+
+    def __init__(self, directory: str = OVERLAY_DIR, max_entries: int = MEMORY_ENTRIES,
+                 disk_entries: int = DISK_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.disk_entries = disk_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, path: str) -> None:
+        self._memory[key] = path
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune_disk(self) -> None:
+        """Remove the least recently used PNGs beyond disk_entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".png"):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        if len(entries) <= self.disk_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._memory.pop(os.path.basename(path)[:-4], None)
+
+    def get(self, key: str):
+        """Return the PNG path for a key if it is cached, or None"""
+        path = self._memory.get(key)
+        if path is not None and os.path.exists(path):
+            self._memory.move_to_end(key)
+            return path
+
+        path = os.path.join(self.directory, f"{key}.png")
+        if not os.path.exists(path):
+            self._memory.pop(key, None)
+            return None
+        # Touch it so disk pruning sees it as recently used
+        os.utime(path)
+        self._remember(key, path)
+        return path
+
+    async def path(self, text: str, style) -> str:
+        """Return the path of the overlay PNG for text in style, rendering it on first use"""
+        key = overlay_key(text, style)
+        path = self.get(key)
+        if path is not None:
+            self.hits += 1
+            return path
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # Rendered in its own task, so cancelling the caller that started it doesn't cancel it
+            inflight = asyncio.ensure_future(self._render(key, text, style))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda task: self._settled(key, task))
+        return await asyncio.shield(inflight)
+
+    async def _render(self, key: str, text: str, style) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{key}.png")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, render_overlay, text, style, path)
+        self._remember(key, path)
+        await loop.run_in_executor(None, self._prune_disk)
+        return path
+
+    def _settled(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieve the exception so it isn't reported as never retrieved when every caller gave up
+            task.exception()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+# One cache per process so every bot handler reuses the same overlays
+overlay_cache = OverlayCache()
@@ -0,0 +1,256 @@
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import aiohttp
+
+import downloader
+import http_client
+
+logger = logging.getLogger(__name__)
+
+# Pipeline configuration (override through environment variables)
+CHUNK_SIZE = 1024 * 1024  # 1MB reads from the download stream
+MIN_HEAD_START = 16 * 1024 * 1024  # Bytes on disk before an upload may begin
+UPLOAD_RATE = float(os.getenv("PIPELINE_UPLOAD_RATE", 4 * 1024 * 1024))  # Initial guess, bytes/s
+SAFETY_MARGIN = 0.2  # Start later than the rate estimate says, so the upload rarely has to wait
+READ_STALL_TIMEOUT = 60  # Seconds a read may wait for bytes before the upload is abandoned
+READ_AHEAD = 1024 * 1024  # Bytes that must be on disk past the read position before the next read; Pyrogram reads 512KB parts
+
+T = TypeVar("T")
+
+# Smoothed Telegram upload rate, refined after every pipelined upload
+_upload_rate = UPLOAD_RATE
+
+
+class StreamingDownload(threading.Thread):
+    """Sequential download on its own thread and event loop, publishing how many bytes are on disk.
+
+    It has to live off the bot's loop: Pyrogram reads upload parts with
+    blocking read() calls, and a read waiting for bytes must not stall the
+    download that would produce them.
+    """
+
+    def __init__(self, url: str, file_path: str, total_size: int):
+        super().__init__(daemon=True)
+        self.url = url
+        self.file_path = file_path
+        self.total_size = total_size
+        self.available = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.started_at = time.monotonic()
+        self.condition = threading.Condition()
+        self._waiters = []  # (loop, future, bytes needed) of coroutines waiting in wait_for()
+        self._stop_requested = False
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.available / elapsed if elapsed > 0 else 0.0
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self._download())
+        except BaseException as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.done = True
+                self._notify()
+
+    def stop(self) -> None:
+        """Ask the download to stop at the next chunk"""
+        self._stop_requested = True
+
+    async def _download(self) -> None:
+        async with aiohttp.ClientSession(timeout=http_client.TIMEOUT) as session:
+            async with session.get(self.url) as response:
+                if response.status != 200:
+                    raise downloader.DownloadError(f"Failed to download file. Status: {response.status}")
+
+                with open(self.file_path, 'wb', buffering=0) as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        if self._stop_requested:
+                            raise downloader.DownloadError("Download stopped")
+                        f.write(chunk)
+                        with self.condition:
+                            self.available += len(chunk)
+                            self._notify()
+
+        if self.available != self.total_size:
+            raise downloader.DownloadError(
+                f"Download ended at {self.available} of {self.total_size} bytes"
+            )
+
+    def _notify(self) -> None:
+        """Wake blocked readers and the waiters whose bytes are now on disk; call with condition held"""
+        self.condition.notify_all()
+        waiting = []
+        for loop, future, needed in self._waiters:
+            if self.done or self.available >= needed:
+                loop.call_soon_threadsafe(_resolve, future)
+            else:
+                waiting.append((loop, future, needed))
+        self._waiters = waiting
+
+    async def wait_for(self, needed: int) -> None:
+        """Wait without blocking the event loop until needed bytes are on disk or the download ended"""
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.done or self.available >= needed:
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future, needed))
+        try:
+            await asyncio.wait_for(future, READ_STALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise IOError("Download stalled while uploading")
+
+    def ready_for_upload(self, upload_rate: float) -> bool:
+        """Return True once an upload started now should never catch up with the download"""
+        if self.done:
+            return True
+        if self.available < min(MIN_HEAD_START, self.total_size):
+            return False
+        download_rate = self.rate
+        if download_rate <= 0:
+            return False
+        download_left = (self.total_size - self.available) / download_rate
+        upload_total = self.total_size / upload_rate
+        return download_left <= upload_total * (1 - SAFETY_MARGIN)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class GrowingFile(io.RawIOBase):
+    """Read-only view of a file that is still being downloaded.
+
+    It reports the final size up front, as Pyrogram needs it before the first
+    part is sent. Pyrogram calls read() on the event loop, so waiting for
+    bytes happens in wait_readable(), awaited from the progress callback
+    (see paced_progress); read() only blocks as a last resort.
+    """
+
+    def __init__(self, download: StreamingDownload, name: str):
+        super().__init__()
+        self.name = name
+        self._download = download
+        self._fp = open(download.file_path, 'rb')
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            offset += self._download.total_size
+        elif whence == io.SEEK_CUR:
+            offset += self._position
+        self._position = max(0, min(offset, self._download.total_size))
+        return self._position
+
+    async def wait_readable(self) -> None:
+        """Wait until the next read will find its bytes on disk"""
+        await self._download.wait_for(min(self._position + READ_AHEAD, self._download.total_size))
+        if self._download.available < min(self._position + READ_AHEAD, self._download.total_size):
+            raise IOError(f"Download failed while uploading: {self._download.error}")
+
+    def read(self, size: int = -1) -> bytes:
+        total = self._download.total_size
+        end = total if size is None or size < 0 else min(self._position + size, total)
+        with self._download.condition:
+            while self._download.available < end and not self._download.done:
+                if not self._download.condition.wait(timeout=READ_STALL_TIMEOUT):
+                    raise IOError("Download stalled while uploading")
+        if self._download.available < end:
+            raise IOError(f"Download failed while uploading: {self._download.error}")
+
+        self._fp.seek(self._position)
+        data = self._fp.read(end - self._position)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        # Pyrogram closes the file after every attempt; stay usable so an upload retry can start over
+        self._position = 0
+
+    def release(self) -> None:
+        """Close the underlying file for good"""
+        self._fp.close()
+        super().close()
+
+
+def paced_progress(source, progress: Callable[[int, int], Awaitable[None]]) -> Callable[[int, int], Awaitable[None]]:
+    """Wrap a Pyrogram progress callback so uploads from a GrowingFile wait for bytes asynchronously.
+
+    Pyrogram awaits the callback after every part it reads, so the next
+    read() finds its bytes on disk instead of blocking the event loop.
+    Other sources get progress back unchanged.
+    """
+    if not isinstance(source, GrowingFile):
+        return progress
+
+    async def paced(current: int, total: int) -> None:
+        await source.wait_readable()
+        await progress(current, total)
+    return paced
+
+
+async def download_and_upload(url: str, file_path: str, upload: Callable[[object], Awaitable[T]]) -> T:
+    """Download url to file_path and upload it, overlapping the two.
+
+    upload is called with a file-like object Pyrogram can send as soon as
+    enough of the file is on disk. When the server doesn't report a size the
+    upload falls back to waiting for the whole file and receives file_path.
+    """
+    global _upload_rate
+    total_size, _, _ = await downloader.probe(http_client.get_session(), url)
+    if not total_size:
+        await downloader.download(url, file_path)
+        return await upload(file_path)
+
+    download = StreamingDownload(url, file_path, total_size)
+    download.start()
+    source = None
+    try:
+        while not download.ready_for_upload(_upload_rate):
+            await asyncio.sleep(0.5)
+        if download.error:
+            raise downloader.DownloadError(str(download.error))
+
+        logger.info(
+            f"Starting upload with {download.available} of {total_size} bytes on disk "
+            f"(download {download.rate / 1024 / 1024:.1f}MB/s, upload estimate {_upload_rate / 1024 / 1024:.1f}MB/s)"
+        )
+        source = GrowingFile(download, os.path.basename(file_path))
+        started_at = time.monotonic()
+        result = await upload(source)
+
+        elapsed = time.monotonic() - started_at
+        if elapsed > 0:
+            _upload_rate = 0.7 * _upload_rate + 0.3 * (total_size / elapsed)
+        return result
+    finally:
+        download.stop()
+        await asyncio.get_running_loop().run_in_executor(None, download.join)
+        if source:
+            source.release()
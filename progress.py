@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits edits per chat and per bot; stay well inside both
+MESSAGE_INTERVAL = 3  # Minimum seconds between edits of one message
+GLOBAL_EDITS_PER_SECOND = 10  # Edit budget shared by every message the bot updates
+GLOBAL_EDIT_BURST = 10  # Edits allowed back to back before the budget applies
+STALE_STATE_AGE = 600  # Forget messages that have not been edited for this long
+SPEED_SMOOTHING = 0.3  # EWMA weight of the newest speed sample
+SPEED_SAMPLE_INTERVAL = 0.5  # Seconds of transfer folded into one speed sample
+
+Render = Callable[[int, int, float, float], str]
+
+
+def _is_flood_wait(error: Exception) -> bool:
+    return type(error).__name__ == "FloodWait" and isinstance(getattr(error, "value", None), (int, float))
+
+
+def _is_not_modified(error: Exception) -> bool:
+    return type(error).__name__ == "MessageNotModified" or "MESSAGE_NOT_MODIFIED" in str(error)
+
+
+class _MessageState:
+    def __init__(self, message):
+        self.message = message
+        self.pending: Optional[str] = None
+        self.last_text: Optional[str] = None
+        self.last_edit = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class ProgressEditor:
+    """Edits progress messages without flooding Telegram.
+
+    Updates for one message are coalesced so only the newest text is sent,
+    at most once per MESSAGE_INTERVAL. All messages share a token bucket,
+    identical text is never re-sent, and a FloodWait pauses edits to that
+    chat with asyncio.sleep instead of blocking the event loop.
+    """
+
+    def __init__(self, message_interval: float = MESSAGE_INTERVAL,
+                 edits_per_second: float = GLOBAL_EDITS_PER_SECOND, burst: int = GLOBAL_EDIT_BURST):
+        self.message_interval = message_interval
+        self.edits_per_second = edits_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._states: Dict[Tuple[int, int], _MessageState] = {}
+        self._chat_hold: Dict[int, float] = {}
+
+    @staticmethod
+    def _key(message) -> Tuple[int, int]:
+        return message.chat.id, message.id
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.edits_per_second)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.edits_per_second)
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        hold = self._chat_hold.get(chat_id, 0) - time.monotonic()
+        if hold > 0:
+            await asyncio.sleep(hold)
+
+    async def _edit(self, state: _MessageState, text: str) -> bool:
+        """Send one edit; return False if it has to be retried after a FloodWait"""
+        try:
+            await state.message.edit_text(text)
+        except Exception as e:
+            if _is_flood_wait(e):
+                logger.warning(f"FloodWait of {e.value}s on chat {state.message.chat.id}")
+                self._chat_hold[state.message.chat.id] = time.monotonic() + e.value
+                return False
+            if not _is_not_modified(e):
+                logger.warning(f"Failed to edit progress message: {str(e)}")
+        state.last_text = text
+        state.last_edit = time.monotonic()
+        return True
+
+    async def _flush(self, state: _MessageState) -> None:
+        chat_id = state.message.chat.id
+        try:
+            while state.pending is not None:
+                delay = state.last_edit + self.message_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._wait_for_chat(chat_id)
+                await self._take_token()
+
+                text, state.pending = state.pending, None
+                if text is None or text == state.last_text:
+                    continue
+                if not await self._edit(state, text) and state.pending is None:
+                    state.pending = text
+        finally:
+            state.task = None
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - STALE_STATE_AGE
+        for key in [key for key, state in self._states.items() if state.task is None and state.last_edit < cutoff]:
+            del self._states[key]
+
+    def update(self, message, text: str) -> None:
+        """Queue text for message; returns immediately and never raises"""
+        key = self._key(message)
+        state = self._states.get(key)
+        if state is None:
+            self._prune()
+            state = self._states[key] = _MessageState(message)
+        if text == state.last_text:
+            state.pending = None
+            return
+        state.pending = text
+        if state.task is None:
+            state.task = asyncio.get_running_loop().create_task(self._flush(state))
+
+    async def finish(self, message, text: Optional[str] = None) -> None:
+        """Drop pending updates for message and optionally send a final text right away"""
+        state = self._states.pop(self._key(message), None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+        if text is None:
+            return
+        state = state or _MessageState(message)
+        if text == state.last_text:
+            return
+        while True:
+            await self._wait_for_chat(message.chat.id)
+            await self._take_token()
+            if await self._edit(state, text):
+                return
+
+
+class SpeedEstimator:
+    """Exponentially smoothed transfer speed"""
+
+    def __init__(self, smoothing: float = SPEED_SMOOTHING):
+        self.smoothing = smoothing
+        self.speed = 0.0
+        self._last_time: Optional[float] = None
+        self._last_bytes = 0
+
+    def update(self, current: int) -> float:
+        now = time.monotonic()
+        if self._last_time is None:
+            self._last_time, self._last_bytes = now, current
+            return self.speed
+        elapsed = now - self._last_time
+        if elapsed < SPEED_SAMPLE_INTERVAL:
+            return self.speed
+        sample = max(0, current - self._last_bytes) / elapsed
+        self.speed = sample if self.speed == 0 else self.smoothing * sample + (1 - self.smoothing) * self.speed
+        self._last_time, self._last_bytes = now, current
+        return self.speed
+
+    def eta(self, current: int, total: int) -> float:
+        """Seconds left at the smoothed speed, or 0 if unknown"""
+        if self.speed <= 0 or total <= 0:
+            return 0.0
+        return max(0, total - current) / self.speed
+
+
+# One editor per process so every transfer shares the same edit budget
+editor = ProgressEditor()
+
+
+class ProgressReporter:
+    """Progress callback for Pyrogram transfers and the downloader.
+
+    render(current, total, speed, eta) builds the message text; the text
+    goes through the shared editor, so calling this often is cheap. Pass the
+    bound update method (not the instance) as Pyrogram's progress argument so
+    it is awaited on the event loop.
+    """
+
+    def __init__(self, message, render: Render, progress_editor: ProgressEditor = editor):
+        self.message = message
+        self.render = render
+        self.editor = progress_editor
+        self.estimator = SpeedEstimator()
+
+    async def update(self, current: int, total: int) -> None:
+        speed = self.estimator.update(current)
+        try:
+            text = self.render(current, total, speed, self.estimator.eta(current, total))
+        except Exception as e:
+            logger.warning(f"Failed to render progress: {str(e)}")
+            return
+        self.editor.update(self.message, text)
+
+    async def finish(self, text: Optional[str] = None) -> None:
+        """Stop reporting, optionally replacing the progress with a final text"""
+        await self.editor.finish(self.message, text)
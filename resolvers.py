@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+# Resolver configuration (override through environment variables)
+REQUEST_TIMEOUT = float(os.getenv("RESOLVER_TIMEOUT", 60))  # Seconds one backend may take
+LATENCY_SAMPLES = 64  # Recent successful latencies kept per backend for the p95
+MIN_SAMPLES = 5  # Samples needed before the p95 replaces DEFAULT_HEDGE_DELAY
+HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_DELAY = 3.0  # Seconds before hedging while a backend has too few samples
+MIN_HEDGE_DELAY = 0.2
+MAX_HEDGE_DELAY = 10.0
+EWMA_ALPHA = 0.2  # Weight of the newest sample in the latency and error averages
+FAILURE_THRESHOLD = 5  # Consecutive failures that open a backend's circuit
+OPEN_SECONDS = 30  # Seconds an open circuit is skipped before one trial request is let through
+
+# Known TeraBox resolvers; {link} is replaced with the quoted share link
+WDZONE_API = "https://wdzone-terabox-api.vercel.app/api?url={link}"
+REDIRECT_WORKER = "https://teraboxredirect1.nkweb.workers.dev/?url={link}"
+TERABOX_APIS = [url for url in os.getenv("TERABOX_APIS", WDZONE_API).split(",") if url]  # wdzone-compatible APIs
+TERABOX_REDIRECTS = [url for url in os.getenv("TERABOX_REDIRECTS", REDIRECT_WORKER).split(",") if url]
+
+DIRECT_LINK_KEY = "🔽 Direct Download Link"
+
+
+class ResolveError(Exception):
+    """Raised when no backend could resolve a link"""
+    pass
+
+
+class NotFound(ResolveError):
+    """A backend answered, but has nothing to download for the link"""
+    pass
+
+
+def backend_name(url_template: str) -> str:
+    """Short name for logs and stats: the template's host and path"""
+    return url_template.split("://")[-1].split("?")[0]
+
+
+class Backend:
+    """One resolver endpoint with its latency, error rate and circuit breaker state"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.failures = 0  # Consecutive
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.requests = 0
+
+    async def fetch(self, session: aiohttp.ClientSession, link: str) -> dict:
+        raise NotImplementedError
+
+    def available(self, now: float) -> bool:
+        """Closed circuits always; open ones for a single trial once OPEN_SECONDS have passed"""
+        if self.opened_at is None:
+            return True
+        return not self.trial_running and now - self.opened_at >= OPEN_SECONDS
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on this backend before asking another; its p95 latency"""
+        if len(self.samples) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, math.ceil(HEDGE_QUANTILE * len(ordered)) - 1)]
+        return min(MAX_HEDGE_DELAY, max(MIN_HEDGE_DELAY, p95))
+
+    def score(self) -> float:
+        """Expected cost of a request; lower is tried first"""
+        latency = self.latency_ewma if self.latency_ewma is not None else DEFAULT_HEDGE_DELAY
+        # A failed attempt costs about a timeout before the next backend gets its turn
+        return latency + self.error_ewma * REQUEST_TIMEOUT
+
+    def _average(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else (1 - EWMA_ALPHA) * current + EWMA_ALPHA * sample
+
+    def record_success(self, latency: float) -> None:
+        self.samples.append(latency)
+        self.latency_ewma = self._average(self.latency_ewma, latency)
+        self.error_ewma = self._average(self.error_ewma, 0.0)
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info(f"Resolver {self.name} recovered")
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.error_ewma = self._average(self.error_ewma, 1.0)
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                logger.warning(f"Resolver {self.name} failed {self.failures} times in a row; routing around it")
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "latency_ewma": self.latency_ewma,
+            "error_ewma": self.error_ewma,
+            "hedge_delay": self.hedge_delay(),
+            "circuit": "closed" if self.opened_at is None else "open",
+        }
+
+
+class WdzoneBackend(Backend):
+    """API answering in the wdzone-terabox-api format"""
+
+    def __init__(self, url_template: str):
+        super().__init__(backend_name(url_template))
+        self.url_template = url_template
+
+    async def fetch(self, session: aiohttp.ClientSession, link: str) -> dict:
+        async with session.get(self.url_template.format(link=quote(link, safe=""))) as resp:
+            if resp.status != 200:
+                raise ResolveError(f"{self.name} answered {resp.status}")
+            data = await resp.json(content_type=None)
+        file_info = (data.get("📜 Extracted Info") or [{}])[0]
+        if data.get("✅ Status") != "Success" or not file_info:
+            raise NotFound("No downloadable file found")
+        return file_info
+
+
+class RedirectBackend(Backend):
+    """Worker that redirects (or proxies) a share link to the file itself"""
+
+    def __init__(self, url_template: str):
+        super().__init__(backend_name(url_template))
+        self.url_template = url_template
+
+    async def fetch(self, session: aiohttp.ClientSession, link: str) -> dict:
+        url = self.url_template.format(link=quote(link, safe=""))
+        # One byte is enough to tell a working link from a dead one
+        async with session.get(url, headers={"Range": "bytes=0-0"}, allow_redirects=False) as resp:
+            if resp.status in (301, 302, 303, 307, 308) and resp.headers.get("Location"):
+                return {DIRECT_LINK_KEY: resp.headers["Location"]}
+            if resp.status in (200, 206):
+                return {DIRECT_LINK_KEY: url}  # The worker streams the file itself
+            if resp.status == 404:
+                raise NotFound("No downloadable file found")
+            raise ResolveError(f"{self.name} answered {resp.status}")
+
+
+class Resolver:
+    """Resolve links through several backends, fastest and healthiest first.
+
+    If the first backend hasn't answered within its p95 latency a second
+    request goes to the next one, and whichever succeeds first wins. A
+    failure moves on to the next backend at once. Backends that keep
+    failing are skipped until their circuit lets a trial request through.
+    """
+
+    def __init__(self, backends: List[Backend],
+                 session_factory: Callable[[], aiohttp.ClientSession] = http_client.get_session):
+        if not backends:
+            raise ValueError("A resolver needs at least one backend")
+        self.backends = backends
+        self.session_factory = session_factory
+        self.hedged = 0
+
+    def _ranked(self) -> List[Backend]:
+        now = time.monotonic()
+        available = [backend for backend in self.backends if backend.available(now)]
+        if not available:
+            # Everything is open; trying the least bad beats failing without asking
+            available = [min(self.backends, key=lambda backend: backend.opened_at)]
+        return sorted(available, key=Backend.score)
+
+    async def _attempt(self, backend: Backend, link: str) -> dict:
+        backend.requests += 1
+        trial = backend.opened_at is not None
+        backend.trial_running = trial
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(backend.fetch(self.session_factory(), link), REQUEST_TIMEOUT)
+        except NotFound:
+            # The backend is healthy; it just has nothing for this link
+            backend.record_success(time.monotonic() - started)
+            raise
+        except asyncio.CancelledError:
+            raise  # Lost a hedge race; says nothing about the backend
+        except Exception:
+            backend.record_failure()
+            raise
+        finally:
+            if trial:
+                backend.trial_running = False
+        backend.record_success(time.monotonic() - started)
+        return result
+
+    async def resolve(self, link: str) -> dict:
+        """Return the first good answer for link; raises NotFound or ResolveError"""
+        candidates = self._ranked()
+        running: Dict[asyncio.Task, Backend] = {}
+        errors: List[str] = []
+        not_found = False
+
+        def launch() -> Optional[Backend]:
+            if not candidates:
+                return None
+            backend = candidates.pop(0)
+            running[asyncio.ensure_future(self._attempt(backend, link))] = backend
+            return backend
+
+        current = launch()
+        try:
+            while running:
+                timeout = current.hedge_delay() if candidates else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The newest request is slower than usual; hedge with the next backend
+                    self.hedged += 1
+                    logger.info(f"Hedging {link} on {candidates[0].name} after {timeout:.1f}s")
+                    current = launch()
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    not_found = not_found or isinstance(error, NotFound)
+                    errors.append(f"{backend.name}: {str(error) or type(error).__name__}")
+                    # Don't wait out a hedge delay after a failure; ask the next backend now
+                    current = launch() or current
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+        if not_found:
+            raise NotFound("No downloadable file found")
+        raise ResolveError(f"API request failed: {'; '.join(errors)}")
+
+    def stats(self) -> dict:
+        """Return per-backend latency, error rate and circuit state"""
+        return {
+            "hedged": self.hedged,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+
+def terabox_resolver(include_redirects: bool = False) -> Resolver:
+    """Resolver over the configured TeraBox APIs, plus the redirect workers if asked for"""
+    backends: List[Backend] = [WdzoneBackend(url) for url in TERABOX_APIS]
+    if include_redirects:
+        # Listed first, so they are tried first until there are measurements to go by
+        backends = [RedirectBackend(url) for url in TERABOX_REDIRECTS] + backends
+    return Resolver(backends)
@@ -0,0 +1,137 @@
+import logging
+import os
+from typing import BinaryIO, NamedTuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Sniffer configuration
+HEAD_SIZE = 4096  # Bytes read from the start of a file; enough for every signature below
+TS_PACKET = 188  # MPEG-TS packet size; three sync bytes in a row identify a stream
+
+
+class FileType(NamedTuple):
+    kind: str  # "video", "audio", "image", "archive" or "document"
+    extension: str  # Preferred extension, with the dot; "" when unknown
+    mime_type: str = "application/octet-stream"
+
+    @property
+    def is_video(self) -> bool:
+        return self.kind == "video"
+
+
+UNKNOWN = FileType("document", "")
+
+# ISO base media brands (bytes 8-12 of an ftyp box) that aren't plain MP4 video
+FTYP_BRANDS = {
+    b"qt  ": FileType("video", ".mov", "video/quicktime"),
+    b"M4A ": FileType("audio", ".m4a", "audio/mp4"),
+    b"M4B ": FileType("audio", ".m4a", "audio/mp4"),
+    b"heic": FileType("image", ".heic", "image/heic"),
+    b"heix": FileType("image", ".heic", "image/heic"),
+    b"mif1": FileType("image", ".heic", "image/heif"),
+    b"avif": FileType("image", ".avif", "image/avif"),
+}
+MP4 = FileType("video", ".mp4", "video/mp4")
+THREE_GP = FileType("video", ".3gp", "video/3gpp")
+
+# Signatures found at offset 0, checked in order
+MAGIC = [
+    (b"\x89PNG\r\n\x1a\n", FileType("image", ".png", "image/png")),
+    (b"\xff\xd8\xff", FileType("image", ".jpg", "image/jpeg")),
+    (b"GIF87a", FileType("image", ".gif", "image/gif")),
+    (b"GIF89a", FileType("image", ".gif", "image/gif")),
+    (b"FLV\x01", FileType("video", ".flv", "video/x-flv")),
+    (b"\x30\x26\xb2\x75\x8e\x66\xcf\x11", FileType("video", ".wmv", "video/x-ms-wmv")),
+    (b"\x00\x00\x01\xba", FileType("video", ".mpg", "video/mpeg")),
+    (b"OggS", FileType("audio", ".ogg", "audio/ogg")),
+    (b"fLaC", FileType("audio", ".flac", "audio/flac")),
+    (b"ID3", FileType("audio", ".mp3", "audio/mpeg")),
+    (b"PK\x03\x04", FileType("archive", ".zip", "application/zip")),
+    (b"Rar!\x1a\x07", FileType("archive", ".rar", "application/vnd.rar")),
+    (b"7z\xbc\xaf\x27\x1c", FileType("archive", ".7z", "application/x-7z-compressed")),
+    (b"\x1f\x8b", FileType("archive", ".gz", "application/gzip")),
+    (b"%PDF-", FileType("document", ".pdf", "application/pdf")),
+]
+
+# RIFF form types (bytes 8-12)
+RIFF_FORMS = {
+    b"AVI ": FileType("video", ".avi", "video/x-msvideo"),
+    b"WEBP": FileType("image", ".webp", "image/webp"),
+    b"WAVE": FileType("audio", ".wav", "audio/wav"),
+}
+
+# Extensions that name the same container as the sniffed one, so the file keeps its name
+EQUIVALENT_EXTENSIONS = {
+    ".mp4": {".mp4", ".m4v"},
+    ".jpg": {".jpg", ".jpeg"},
+    ".mpg": {".mpg", ".mpeg"},
+    ".ts": {".ts", ".m2ts", ".mts"},
+    ".3gp": {".3gp", ".3g2"},
+}
+
+# Every extension the sniffer can produce, so a wrong one is replaced rather than kept
+KNOWN_EXTENSIONS = {file_type.extension for _, file_type in MAGIC} | {
+    file_type.extension for file_type in list(FTYP_BRANDS.values()) + list(RIFF_FORMS.values())
+} | {".mp4", ".m4v", ".3gp", ".3g2", ".mkv", ".webm", ".ts", ".m2ts", ".mts", ".jpeg", ".mpeg", ".bin"}
+
+
+def _sniff_matroska(head: bytes) -> FileType:
+    # The EBML header carries the DocType ("webm" or "matroska") within its first few dozen bytes
+    if b"webm" in head[:64]:
+        return FileType("video", ".webm", "video/webm")
+    return FileType("video", ".mkv", "video/x-matroska")
+
+
+def sniff_bytes(head: bytes) -> FileType:
+    """Classify a file from its first bytes"""
+    if len(head) >= 12 and head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in FTYP_BRANDS:
+            return FTYP_BRANDS[brand]
+        if brand.startswith((b"3gp", b"3g2")):
+            return THREE_GP
+        return MP4
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return _sniff_matroska(head)
+    if head.startswith(b"RIFF") and head[8:12] in RIFF_FORMS:
+        return RIFF_FORMS[head[8:12]]
+    for magic, file_type in MAGIC:
+        if head.startswith(magic):
+            return file_type
+    if len(head) > 2 * TS_PACKET and head[0] == head[TS_PACKET] == head[2 * TS_PACKET] == 0x47:
+        return FileType("video", ".ts", "video/mp2t")
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return FileType("audio", ".mp3", "audio/mpeg")  # MPEG audio frame without an ID3 tag
+    return UNKNOWN
+
+
+def sniff(source: Union[str, BinaryIO]) -> FileType:
+    """Classify a file path or seekable file object by reading only its first HEAD_SIZE bytes"""
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                head = f.read(HEAD_SIZE)
+        else:
+            position = source.tell()
+            source.seek(0)
+            head = source.read(HEAD_SIZE)
+            source.seek(position)
+    except OSError as e:
+        logger.warning(f"Couldn't read {getattr(source, 'name', source)} to sniff it: {str(e)}")
+        return UNKNOWN
+    return sniff_bytes(head)
+
+
+def file_name(source: Union[str, BinaryIO], file_type: FileType) -> str:
+    """Return source's base name with an extension that matches its content"""
+    name = os.path.basename(source if isinstance(source, str) else getattr(source, "name", "file"))
+    if not file_type.extension:
+        return name
+    stem, ext = os.path.splitext(name)
+    ext = ext.lower()
+    if ext in EQUIVALENT_EXTENSIONS.get(file_type.extension, {file_type.extension}):
+        return name
+    if ext not in KNOWN_EXTENSIONS:
+        # Titles like "Show.S01E02" have dots that aren't extensions; keep them
+        stem = name
+    return stem + file_type.extension
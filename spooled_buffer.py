@@ -0,0 +1,91 @@
+import io
+import logging
+import os
+import tempfile
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Buffer configuration (override through environment variables)
+MEMORY_LIMIT = int(os.getenv("SPOOL_MEMORY_LIMIT", 8 * 1024 * 1024))  # Bytes kept in RAM before spilling to disk
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None  # None uses the system temp directory
+CHUNK_SIZE = 256 * 1024  # Bytes read from the HTTP stream at a time
+
+
+class SpooledBuffer(io.RawIOBase):
+    """Binary buffer that lives in memory until it grows past MEMORY_LIMIT, then moves to a temp file.
+
+    The temp file is unlinked on creation, so its space is returned as soon
+    as the buffer is closed, or when the process exits. Pyrogram accepts it
+    wherever it accepts an open binary file.
+    """
+
+    def __init__(self, name: str = "file", memory_limit: int = MEMORY_LIMIT):
+        super().__init__()
+        self.name = name
+        self.memory_limit = memory_limit
+        self._file = io.BytesIO()
+        self._spilled = False
+
+    @property
+    def spilled(self) -> bool:
+        return self._spilled
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def _rollover(self) -> None:
+        disk_file = tempfile.TemporaryFile(dir=SPOOL_DIR)
+        disk_file.write(self._file.getbuffer())
+        disk_file.seek(self._file.tell())
+        self._file = disk_file
+        self._spilled = True
+
+    def write(self, data) -> int:
+        if not self._spilled and self._file.tell() + len(data) > self.memory_limit:
+            self._rollover()
+        return self._file.write(data)
+
+    def readinto(self, buffer) -> int:
+        data = self._file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+async def download(session: aiohttp.ClientSession, url: str, name: str,
+                   memory_limit: int = MEMORY_LIMIT) -> SpooledBuffer:
+    """Stream url into a SpooledBuffer, rewound and ready to upload; the caller closes it"""
+    buffer = SpooledBuffer(name, memory_limit)
+    try:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                buffer.write(chunk)
+        if buffer.spilled:
+            logger.debug(f"{name} spilled to disk at {buffer.tell()} bytes")
+        buffer.seek(0)
+        return buffer
+    except BaseException:
+        buffer.close()
+        raise
@@ -1,6 +1,10 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 import aiohttp
+import http_client
+import sniff
+from instagram_cache import ResolverCache
+from instagram_links import extract_links
 import os
 import re
 from typing import Optional
@@ -28,39 +32,46 @@ TIMEOUT = 300  # 5 minutes timeout for operations
 # Cache for user preferences
 user_prefs = {}
 
+# Recent API answers by shortcode, so a reel forwarded to many chats is resolved once
+file_info_cache = ResolverCache()
+
 class DownloadError(Exception):
     """Custom exception for download-related errors"""
     pass
 
 async def download_file(url: str, file_path: str) -> None:
     """Download a file from URL to local storage"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise DownloadError(f"Failed to download file. Status: {response.status}")
+    session = http_client.get_session()
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise DownloadError(f"Failed to download file. Status: {response.status}")
+        
+        with open(file_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                f.write(chunk)
+
+async def fetch_file_info(link: str) -> dict:
+    """Get file information from Instagram API"""
+    session = http_client.get_session()
+    api_url = f"https://api.yabes-desu.workers.dev/download/instagram/v2?url={link}"
+    try:
+        async with session.get(api_url, timeout=TIMEOUT) as resp:
+            if resp.status != 200:
+                raise DownloadError("Failed to connect to the API")
+            
+            data = await resp.json()
+            file_info = data.get("data", [{}])[0]
             
-            with open(file_path, 'wb') as f:
-                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                    f.write(chunk)
+            if data.get("Status") != "true" or not file_info:
+                raise DownloadError("No downloadable file found")
+            
+            return file_info
+    except aiohttp.ClientError as e:
+        raise DownloadError(f"API request failed: {str(e)}")
 
 async def get_file_info(link: str) -> dict:
-    """Get file information from Instagram API"""
-    async with aiohttp.ClientSession() as session:
-        api_url = f"https://api.yabes-desu.workers.dev/download/instagram/v2?url={link}"
-        try:
-            async with session.get(api_url, timeout=TIMEOUT) as resp:
-                if resp.status != 200:
-                    raise DownloadError("Failed to connect to the API")
-                
-                data = await resp.json()
-                file_info = data.get("data", [{}])[0]
-                
-                if data.get("Status") != "true" or not file_info:
-                    raise DownloadError("No downloadable file found")
-                
-                return file_info
-        except aiohttp.ClientError as e:
-            raise DownloadError(f"API request failed: {str(e)}")
+    """Get file information, reusing a recent lookup of the same post"""
+    return await file_info_cache.get_or_fetch(link, fetch_file_info)
 
 @app.on_message(filters.command("start"))
 async def start_handler(client: Client, message: Message):
@@ -109,9 +120,10 @@ async def help_handler(client: Client, message: Message):
 @app.on_message(filters.text)
 async def link_handler(client: Client, message: Message):
     """Handle Instagram links"""
-    link = message.text.strip()
-    if not TERABOX_REGEX.match(link):
+    links = extract_links(message.text, limit=1)
+    if not links:
         return
+    link = links[0]
     
     user_id = message.from_user.id
     upload_mode = user_prefs.get(user_id, {}).get("upload_mode", False)
@@ -158,10 +170,14 @@ async def link_handler(client: Client, message: Message):
                 # Upload the file
                 await processing_msg.edit_text("⬆️ Uploading file...")
                 
-                if file_path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
+                # Choose video or document from the content, not the API's title
+                file_type = sniff.sniff(file_path)
+                name = sniff.file_name(file_path, file_type)
+                if file_type.is_video:
                     # Upload as video
                     await message.reply_video(
                         video=file_path,
+                        file_name=name,
                         caption=caption,
                         supports_streaming=True,
                         progress=lambda current, total: logger.info(f"Uploaded {current}/{total} bytes")
@@ -170,6 +186,7 @@ async def link_handler(client: Client, message: Message):
                     # Upload as document
                     await message.reply_document(
                         document=file_path,
+                        file_name=name,
                         caption=caption,
                         progress=lambda current, total: logger.info(f"Uploaded {current}/{total} bytes")
                     )
@@ -181,6 +198,8 @@ async def link_handler(client: Client, message: Message):
                 
             except Exception as upload_error:
                 logger.error(f"Upload failed: {str(upload_error)}")
+                # The CDN link may have expired; look it up again next time
+                file_info_cache.invalidate(link)
                 # Fall back to sending the link
                 should_upload = False
         
@@ -207,4 +226,5 @@ async def link_handler(client: Client, message: Message):
 
 if __name__ == "__main__":
     logger.info("Starting Instagram Downloader Bot...")
-    app.run()
+    # Shared HTTP pool opens with the bot and closes when it stops
+    http_client.run(app)
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instagram_links import canonical_url, extract_links  # noqa: E402
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.instagram.com/p/Cx1_a-B/", "https://www.instagram.com/p/Cx1_a-B/"),
+    ("instagram.com/reel/Cx1/?igsh=abc", "https://www.instagram.com/reel/Cx1/"),
+    ("http://m.instagram.com/someone/reels/Cx1", "https://www.instagram.com/reel/Cx1/"),
+    ("www.instagr.am/tv/Cx1", "https://www.instagram.com/tv/Cx1/"),
+    ("https://instagram.com/stories/some.one/3141592653/", "https://www.instagram.com/stories/some.one/3141592653/"),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "fakeinstagram.com/p/X",
+    "https://fakeinstagram.com/p/X",
+    "https://www.notinstagram.com/reel/X/",
+    "evil-instagram.com/p/X",
+    "https://cdn.instagram.com/p/X",
+])
+def test_lookalike_hosts_dont_match(url):
+    assert canonical_url(url) is None
+    assert extract_links(url) == []
+
+
+def test_extract_links_in_message():
+    text = "see (https://www.instagram.com/p/A1/) and fakeinstagram.com/p/B2, then instagram.com/reels/A1"
+    assert extract_links(text) == ["https://www.instagram.com/p/A1/"]
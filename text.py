@@ -1,10 +1,10 @@
 import os
-import time
+from functools import partial
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import FloodWait
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
-from PIL import ImageFont
+from progress import ProgressReporter
+from watermark_pool import WatermarkPool, PoolBusy, JobCancelled
+from watermark_engine import WatermarkStyle, watermark_video
 
 # Bot configuration
 API_ID = 1234567  # Replace with your API ID
@@ -19,6 +19,9 @@ app = Client(
     bot_token=BOT_TOKEN
 )
 
+# Bounded, cancellable slots for the ffmpeg encodes
+watermark_pool = WatermarkPool()
+
 # Welcome message handler
 @app.on_message(filters.command(["start", "help"]))
 async def welcome(client: Client, message: Message):
@@ -43,36 +46,27 @@ async def welcome(client: Client, message: Message):
         ])
     )
 
-# Progress callback function
-async def progress(current, total, message: Message, start_time, operation):
-    try:
-        percent = current * 100 / total
-        elapsed_time = time.time() - start_time
-        speed = current / elapsed_time if elapsed_time > 0 else 0
-        
-        # Progress bar
-        progress_bar = "[" + "■" * int(percent / 5) + " " * (20 - int(percent / 5)) + "]"
-        
-        speed_text = ""
-        if speed > 1024 * 1024:
-            speed_text = f"{speed / (1024 * 1024):.2f} MB/s"
-        elif speed > 1024:
-            speed_text = f"{speed / 1024:.2f} KB/s"
-        else:
-            speed_text = f"{speed:.2f} B/s"
-        
-        text = (
-            f"**{operation}...**\n"
-            f"{progress_bar} {percent:.2f}%\n"
-            f"**Speed:** {speed_text}\n"
-            f"**Processed:** {human_readable_size(current)} / {human_readable_size(total)}"
-        )
-        
-        await message.edit_text(text)
-    except FloodWait as e:
-        time.sleep(e.value)
-    except Exception:
-        pass
+# Progress text for downloads and uploads
+def render_progress(operation, current, total, speed, eta):
+    percent = current * 100 / total if total else 0
+    
+    # Progress bar
+    progress_bar = "[" + "■" * int(percent / 5) + " " * (20 - int(percent / 5)) + "]"
+    
+    speed_text = ""
+    if speed > 1024 * 1024:
+        speed_text = f"{speed / (1024 * 1024):.2f} MB/s"
+    elif speed > 1024:
+        speed_text = f"{speed / 1024:.2f} KB/s"
+    else:
+        speed_text = f"{speed:.2f} B/s"
+    
+    return (
+        f"**{operation}...**\n"
+        f"{progress_bar} {percent:.2f}%\n"
+        f"**Speed:** {speed_text} | **ETA:** {int(eta)}s\n"
+        f"**Processed:** {human_readable_size(current)} / {human_readable_size(total)}"
+    )
 
 def human_readable_size(size):
     if size < 1024:
@@ -84,49 +78,31 @@ def human_readable_size(size):
     else:
         return f"{size / (1024 * 1024 * 1024):.2f} GB"
 
+# Watermark look: bold white text with a thin black outline, bottom centre
+WATERMARK_STYLE = WatermarkStyle(
+    font_file="arialbd.ttf",
+    font_size=50,
+    color="white",
+    opacity=0.7,
+    stroke_color="black",
+    stroke_width=1,
+    position="bottom-center"
+)
+
 # Video processing function
-def add_watermark(video_path, output_path, watermark_text="Sample Watermark"):
-    try:
-        # Load video
-        video = VideoFileClip(video_path)
-        
-        # Create watermark text
-        txt_clip = (
-            TextClip(
-                watermark_text,
-                fontsize=50,
-                color="white",
-                font="Arial-Bold",
-                stroke_color="black",
-                stroke_width=1
-            )
-            .set_position(("center", "bottom"))
-            .set_duration(video.duration)
-            .set_opacity(0.7)
-        )
-        
-        # Composite the video with watermark
-        final_clip = CompositeVideoClip([video, txt_clip])
-        
-        # Write the result to a file
-        final_clip.write_videofile(
-            output_path,
-            codec="libx264",
-            audio_codec="aac",
-            threads=4,
-            preset="ultrafast",
-            logger=None
-        )
-        
-        return True
-    except Exception as e:
-        print(f"Error in watermarking: {e}")
-        return False
-    finally:
-        if 'video' in locals():
-            video.close()
-        if 'final_clip' in locals():
-            final_clip.close()
+async def add_watermark(video_path, output_path, watermark_text="Sample Watermark"):
+    return await watermark_video(
+        video_path, output_path, watermark_text, WATERMARK_STYLE,
+        backlog=watermark_pool.backlog, workers=watermark_pool.workers
+    )
+
+# Cancel handler
+@app.on_message(filters.command("cancel"))
+async def cancel_watermark(client: Client, message: Message):
+    if watermark_pool.cancel(message.from_user.id):
+        await message.reply_text("🛑 Cancelling your watermark job...")
+    else:
+        await message.reply_text("You have no watermark job running.")
 
 # Video message handler
 @app.on_message(filters.video | filters.document)
@@ -144,25 +120,33 @@ async def handle_video(client: Client, message: Message):
     )
     
     processing_msg = await message.reply_text("📥 Downloading video...")
-    start_time = time.time()
     
     # Download the video
     video_path = f"downloads/{message.from_user.id}_{message.id}.mp4"
     os.makedirs("downloads", exist_ok=True)
     
+    download_progress = ProgressReporter(processing_msg, partial(render_progress, "Downloading"))
     await message.download(
         file_name=video_path,
-        progress=lambda current, total: await progress(
-            current, total, processing_msg, start_time, "Downloading"
-        )
+        progress=download_progress.update
     )
+    await download_progress.finish()
     
     # Process the video
     await processing_msg.edit_text("🔄 Adding watermark...")
     output_path = f"downloads/{message.from_user.id}_{message.id}_watermarked.mp4"
     
-    if not add_watermark(video_path, output_path, watermark_text.text):
-        await processing_msg.edit_text("❌ Failed to add watermark. Please try again.")
+    # Encode in a worker slot; ffmpeg runs in its own process, so the bot keeps answering other users
+    failure_text = "❌ Failed to add watermark. Please try again."
+    try:
+        success = await watermark_pool.run(message.from_user.id, add_watermark, video_path, output_path, watermark_text.text)
+    except PoolBusy:
+        success, failure_text = False, "⏳ Too many videos are queued. Please try again later."
+    except JobCancelled:
+        success, failure_text = False, "🛑 Watermark cancelled."
+    
+    if not success:
+        await processing_msg.edit_text(failure_text)
         try:
             os.remove(video_path)
             os.remove(output_path)
@@ -172,16 +156,15 @@ async def handle_video(client: Client, message: Message):
     
     # Upload the watermarked video
     await processing_msg.edit_text("📤 Uploading watermarked video...")
-    upload_start_time = time.time()
+    upload_progress = ProgressReporter(processing_msg, partial(render_progress, "Uploading"))
     
     await message.reply_video(
         video=output_path,
         caption=f"Here's your watermarked video with text: {watermark_text.text}",
-        progress=lambda current, total: await progress(
-            current, total, processing_msg, upload_start_time, "Uploading"
-        )
+        progress=upload_progress.update
     )
     
+    await upload_progress.finish()
     await processing_msg.delete()
     
     # Clean up
@@ -192,5 +175,6 @@ async def handle_video(client: Client, message: Message):
         pass
 
 # Start the bot
-print("Bot is running...")
-app.run()
+if __name__ == "__main__":
+    print("Bot is running...")
+    app.run()
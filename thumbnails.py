@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from encoding_policy import probe_video
+
+try:
+    import numpy as np
+except ImportError:  # Without NumPy thumbnails come from the fixed SEEK_TIME
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail configuration (override through environment variables)
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "thumbnails")
+MAX_PROCESSES = int(os.getenv("THUMBNAIL_PROCESSES", 4))  # ffmpeg processes running at once
+MAX_CACHED = int(os.getenv("THUMBNAIL_CACHE_ENTRIES", 1000))  # Thumbnails kept on disk before the oldest are removed
+THUMBNAIL_SIZE = 320  # Telegram's limit for the longer side
+SEEK_TIME = 5  # Seconds into the video the frame is taken from
+HASH_SAMPLE = 1024 * 1024  # Bytes hashed from the start, middle and end of a file
+SAMPLE_FRAMES = int(os.getenv("THUMBNAIL_SAMPLES", 6))  # Keyframes scored when picking a thumbnail
+TIME_BUDGET = float(os.getenv("THUMBNAIL_TIME_BUDGET", 3))  # Seconds the picker may spend per file
+SAMPLE_SPAN = (0.05, 0.6)  # Part of the video sampled, skipping intros and end cards
+BLACK_LEVEL = 0.08  # Mean brightness below which a frame counts as black
+SHARPNESS_SCALE = 500.0  # Laplacian variance treated as fully sharp
+
+_semaphore: Optional[asyncio.Semaphore] = None
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def file_hash(path: str) -> str:
+    """Hash a file's size and samples of its content; cheap enough for multi-GB videos"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - HASH_SAMPLE // 2), max(0, size - HASH_SAMPLE)):
+            f.seek(offset)
+            digest.update(f.read(HASH_SAMPLE))
+    return digest.hexdigest()
+
+
+def _prune() -> None:
+    """Remove the least recently used thumbnails beyond MAX_CACHED"""
+    entries = []
+    for name in os.listdir(THUMBNAIL_DIR):
+        if name.endswith(".jpg"):
+            path = os.path.join(THUMBNAIL_DIR, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - MAX_CACHED)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def score_frame(path: str) -> float:
+    """Score a frame for use as a thumbnail from its exposure, entropy and sharpness (0-1)"""
+    with Image.open(path) as image:
+        gray = np.asarray(image.convert("L"), dtype=np.float32)
+    brightness = gray.mean() / 255
+
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256) / gray.size
+    histogram = histogram[histogram > 0]
+    entropy = float(-(histogram * np.log2(histogram)).sum()) / 8
+
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1]
+                 - gray[1:-1, :-2] - gray[1:-1, 2:])
+    sharpness = min(1.0, float(laplacian.var()) / SHARPNESS_SCALE)
+
+    exposure = 1 - abs(brightness - 0.5) * 2
+    score = 0.5 * entropy + 0.3 * sharpness + 0.2 * exposure
+    if brightness < BLACK_LEVEL or brightness > 1 - BLACK_LEVEL / 2:
+        score *= 0.1  # Black, white or fade frames only win if nothing else is usable
+    return score
+
+
+async def _extract(video_path: str, output_path: str, seek: float, keyframe_only: bool = False) -> bool:
+    """Grab one frame at seek, scaled to fit THUMBNAIL_SIZE, in a single ffmpeg pass"""
+    temp_path = output_path + ".tmp.jpg"
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+        # Decoding only keyframes makes a sample cost one frame
+        *(["-skip_frame", "nokey"] if keyframe_only else []),
+        # -ss before -i seeks in the demuxer instead of decoding up to the frame
+        "-ss", str(seek), "-i", video_path,
+        "-frames:v", "1",
+        "-vf", f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease",
+        "-q:v", "3",
+        temp_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if process.returncode != 0 or not os.path.exists(temp_path) or not os.path.getsize(temp_path):
+        if stderr:
+            logger.debug(f"ffmpeg thumbnail at {seek}s failed: {stderr.decode(errors='replace').strip()}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    os.replace(temp_path, output_path)
+    return True
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_PROCESSES)
+    return _semaphore
+
+
+async def _sample(video_path: str, candidate: str, seek: float) -> Tuple[float, str]:
+    async with _get_semaphore():
+        if not await _extract(video_path, candidate, seek, keyframe_only=True):
+            return -1.0, candidate
+    score = await asyncio.get_running_loop().run_in_executor(None, score_frame, candidate)
+    return score, candidate
+
+
+async def _pick(video_path: str, output_path: str) -> bool:
+    """Score keyframes spread over the video and keep the best one found within TIME_BUDGET"""
+    deadline = time.monotonic() + TIME_BUDGET
+    info = await asyncio.wait_for(probe_video(video_path), TIME_BUDGET)
+    if not info or not info.duration:
+        return False
+
+    start, end = (info.duration * fraction for fraction in SAMPLE_SPAN)
+    step = (end - start) / max(1, SAMPLE_FRAMES - 1)
+    tasks = [
+        asyncio.ensure_future(_sample(video_path, f"{output_path}.{index}.jpg", start + index * step))
+        for index in range(SAMPLE_FRAMES)
+    ]
+    candidates: List[str] = [f"{output_path}.{index}.jpg" for index in range(SAMPLE_FRAMES)]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+        results = [task.result() for task in done if not task.exception()]
+        score, best = max(results, default=(-1.0, ""))
+        if score < 0:
+            return False
+        logger.info(f"Picked thumbnail for {os.path.basename(video_path)} from {len(results)} samples (score {score:.2f})")
+        os.replace(best, output_path)
+        return True
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                os.remove(candidate)
+
+
+async def _generate(video_path: str, output_path: str, seek: Optional[float]) -> Optional[str]:
+    picked = False
+    if seek is None and np is not None:
+        try:
+            picked = await _pick(video_path, output_path)
+        except (asyncio.TimeoutError, OSError, ValueError) as e:
+            logger.warning(f"Thumbnail picker failed for {video_path}: {str(e)}")
+    if not picked:
+        seek = SEEK_TIME if seek is None else seek
+        async with _get_semaphore():
+            # Videos shorter than seek have no frame there; fall back to the first frame
+            if not await _extract(video_path, output_path, seek) and not (seek and await _extract(video_path, output_path, 0)):
+                return None
+    await asyncio.get_running_loop().run_in_executor(None, _prune)
+    return output_path
+
+
+def _settled(output_path: str, task: asyncio.Future) -> None:
+    if _inflight.get(output_path) is task:
+        del _inflight[output_path]
+    if not task.cancelled():
+        # Retrieve the exception so it isn't reported as never retrieved when every caller gave up
+        task.exception()
+
+
+async def generate(video_path: str, seek: Optional[float] = None) -> Optional[str]:
+    """Return a JPEG thumbnail (at most THUMBNAIL_SIZE px) for video_path, or None.
+
+    Without seek the most representative of a few keyframes is picked,
+    falling back to the frame at SEEK_TIME. Thumbnails are cached by
+    content hash, so sending the same file again skips ffmpeg. The
+    returned file belongs to the cache; don't delete it.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, file_hash, video_path)
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        output_path = os.path.join(THUMBNAIL_DIR, f"{key}_{'auto' if seek is None else f'{seek:g}'}.jpg")
+        if os.path.exists(output_path):
+            # Touch it so pruning sees it as recently used
+            os.utime(output_path)
+            return output_path
+
+        inflight = _inflight.get(output_path)
+        if inflight is None:
+            # Extracted in its own task, so cancelling the caller that started it doesn't cancel it
+            inflight = asyncio.ensure_future(_generate(video_path, output_path, seek))
+            _inflight[output_path] = inflight
+            inflight.add_done_callback(lambda task: _settled(output_path, task))
+        # Shield so one impatient caller can't cancel the extraction for everyone else
+        return await asyncio.shield(inflight)
+    except OSError as e:
+        logger.error(f"Thumbnail generation failed: {e}")
+        return None
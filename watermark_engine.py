@@ -0,0 +1,400 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from typing import List, NamedTuple, Optional, Tuple
+
+from encoding_policy import CORES, EncodingSettings, VideoInfo, settings_for
+import media_probe
+from media_probe import FFPROBE
+from overlay_cache import overlay_cache
+
+logger = logging.getLogger(__name__)
+
+# Encoder configuration (override through environment variables)
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+VIDEO_CODEC = "libx264"
+MARGIN = 10  # Pixels between the watermark and the frame edge
+KEYFRAME_SCAN = 20  # Seconds searched on each side of a cut point for keyframes
+PARALLEL_MIN_DURATION = float(os.getenv("PARALLEL_MIN_DURATION", 600))  # Videos this long are encoded in parallel chunks
+MIN_CHUNK_DURATION = 120  # Seconds; shorter chunks cost more in per-process overhead than they save
+SEEK_EPSILON = 0.001  # Seconds past a keyframe to seek to; well under a frame, above ffprobe's rounding
+SPLICE_TOLERANCE = 0.1  # Seconds the joined pieces may differ from the source; a duplicated GOP is far longer
+
+# libx264 names of the H.264 profiles ffprobe reports, and the pixel formats it can encode
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+X264_PIX_FMTS = {
+    "yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p",
+    "yuv420p10le", "yuv422p10le", "yuv444p10le",
+}
+
+Window = Tuple[float, float]  # Seconds from the start of the video
+Segment = Tuple[float, float, bool]  # start, end, re-encode
+
+# Encodes currently running in this process, the default backlog for the encoding policy
+_active_encodes = 0
+
+# x/y expressions for the overlay filter (W/H: video size, w/h: watermark size), keyed by position name
+POSITIONS = {
+    "top-left": (f"{MARGIN}", f"{MARGIN}"),
+    "top-right": (f"W-w-{MARGIN}", f"{MARGIN}"),
+    "bottom-left": (f"{MARGIN}", f"H-h-{MARGIN}"),
+    "bottom-right": (f"W-w-{MARGIN}", f"H-h-{MARGIN}"),
+    "bottom-center": ("(W-w)/2", f"H-h-{MARGIN}"),
+    "center": ("(W-w)/2", "(H-h)/2"),
+}
+
+
+class WatermarkStyle(NamedTuple):
+    font_file: Optional[str] = None
+    font_size: int = 48
+    color: str = "white"
+    opacity: float = 1.0  # 0-1
+    stroke_color: Optional[str] = None
+    stroke_width: int = 0
+    position: str = "bottom-right"
+
+
+def position_xy(position: str):
+    """Return overlay x/y expressions; accepts top_left as well as top-left"""
+    return POSITIONS.get(position.replace("_", "-"), POSITIONS["bottom-right"])
+
+
+def overlay_filter(style: WatermarkStyle, scale: Optional[str] = None, windows: Optional[List[Window]] = None) -> str:
+    """Build the filtergraph that places input 1 (the watermark PNG) on input 0.
+
+    The video is scaled first if scale is given, and the watermark is only
+    shown during windows (seconds from the start of input 0) if given.
+    """
+    x, y = position_xy(style.position)
+    overlay = f"overlay=x={x}:y={y}"
+    if windows:
+        overlay += ":enable='" + "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in windows) + "'"
+    if scale:
+        return f"[0:v]{scale}[base];[base][1:v]{overlay}"
+    return f"[0:v][1:v]{overlay}"
+
+
+def branding_windows(duration: float, intro: float, outro: float) -> Optional[List[Window]]:
+    """Return the intro/outro windows to watermark, or None to watermark the whole video"""
+    if not intro and not outro:
+        return None
+    windows = []
+    if intro:
+        windows.append((0.0, min(intro, duration)))
+    if outro:
+        windows.append((max(0.0, duration - outro), duration))
+    return _merge(windows)
+
+
+def _merge(ranges: List[Window]) -> List[Window]:
+    merged: List[Window] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def plan_segments(windows: List[Window], keyframes: List[float], duration: float) -> List[Segment]:
+    """Split [0, duration] at keyframes into (start, end, encode) pieces.
+
+    Only the pieces that overlap a window are re-encoded; each is widened
+    to the keyframe at or before its start and the first keyframe at or
+    after its end, so the stream-copied pieces around it begin on a
+    keyframe.
+    """
+    keyframes = sorted(set(keyframes))
+    encoded = []
+    for start, end in windows:
+        before = [k for k in keyframes if k <= start]
+        after = [k for k in keyframes if k >= end]
+        encoded.append((before[-1] if before else 0.0, after[0] if after else duration))
+
+    segments: List[Segment] = []
+    position = 0.0
+    for start, end in _merge(encoded):
+        if start > position:
+            segments.append((position, start, False))
+        segments.append((start, end, True))
+        position = end
+    if position < duration:
+        segments.append((position, duration, False))
+    return segments
+
+
+def source_match_args(info: VideoInfo) -> Optional[List[str]]:
+    """libx264 options reproducing info's profile, level and pixel format, or None if it can't.
+
+    Spliced pieces end up in one MP4 track whose avcC box describes the
+    first piece, so the re-encoded pieces must decode with the same
+    parameters as the stream-copied ones.
+    """
+    profile = X264_PROFILES.get(info.profile)
+    if not profile or info.pix_fmt not in X264_PIX_FMTS or info.level <= 0:
+        return None
+    level = "1b" if info.level == 9 else f"{info.level // 10}.{info.level % 10}"
+    return ["-pix_fmt", info.pix_fmt, "-profile:v", profile, "-level", level]
+
+
+def plan_chunks(cuts: List[float], keyframes: List[float], duration: float) -> List[Segment]:
+    """Split [0, duration] into re-encoded chunks at the keyframe nearest each cut"""
+    points = set()
+    for cut in cuts:
+        if keyframes:
+            points.add(min(keyframes, key=lambda k: abs(k - cut)))
+    bounds = [0.0] + sorted(point for point in points if 0 < point < duration) + [duration]
+    return [(start, end, True) for start, end in zip(bounds, bounds[1:])]
+
+
+async def keyframe_times(path: str, around: List[float]) -> List[float]:
+    """Return video keyframe times near the given positions, read from packet flags without decoding"""
+    intervals = ",".join(f"{max(0.0, position - KEYFRAME_SCAN):.3f}%+{2 * KEYFRAME_SCAN}" for position in around)
+    process = await asyncio.create_subprocess_exec(
+        FFPROBE, "-v", "error", "-select_streams", "v:0", "-read_intervals", intervals,
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await process.communicate()
+    keyframes = []
+    for line in stdout.decode(errors="replace").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    return keyframes
+
+
+async def run_ffmpeg(args: List[str]) -> bool:
+    """Run ffmpeg with args; kill it if the caller is cancelled"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        logger.error(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+        return False
+    return True
+
+
+def _cut_args(segment: Segment, duration: float) -> Tuple[List[str], List[str]]:
+    """Input and output options selecting the frames of a re-encoded segment.
+
+    Input seeking lands on the last keyframe at or before -ss, so seeking a
+    hair past the keyframe can't fall back to the previous one when
+    ffprobe's printed pts_time is rounded; -t likewise stops a hair before
+    the next piece's keyframe. No time is rounded to fewer digits than
+    ffprobe printed.
+    """
+    start, end, _ = segment
+    seek = start + SEEK_EPSILON
+    if end >= duration:
+        return ["-ss", f"{seek:.6f}"], []  # Last piece runs to the end of the file
+    return ["-ss", f"{seek:.6f}"], ["-t", f"{end - SEEK_EPSILON - seek:.6f}"]
+
+
+def _segment_args(input_path: str, overlay_path: str, style: WatermarkStyle, settings: EncodingSettings,
+                  segment: Segment, piece: str, duration: float, scale: Optional[str],
+                  windows: Optional[List[Window]], source_args: List[str]) -> List[str]:
+    start, end, _ = segment
+    seek, limit = _cut_args(segment, duration)
+    # Without accurate seeking decoding starts at the keyframe itself instead of dropping it as "before -ss"
+    shifted = [(max(0.0, a - start), b - start) for a, b in windows if a < end and b > start] if windows else None
+    return [
+        "-noaccurate_seek", *seek, "-i", input_path, "-i", overlay_path, *limit,
+        "-filter_complex", overlay_filter(style, scale, shifted) + "[v]", "-map", "[v]", "-an",
+        "-c:v", VIDEO_CODEC, *source_args, "-preset", settings.preset, "-crf", str(settings.crf),
+        "-threads", str(settings.threads), "-f", "mpegts", piece
+    ]
+
+
+def _split_args(input_path: str, segments: List[Segment], pattern: str) -> List[str]:
+    """Options splitting the source's video track into one copied piece per segment.
+
+    -t can't cut copied packets: it is checked in decode order, so with
+    B-frames it lets the next keyframe through. The segment muxer instead
+    starts a piece at the first keyframe at or after each split time and
+    hands every packet to exactly one piece.
+    """
+    times = ",".join(f"{start - SEEK_EPSILON:.6f}" for start, _, _ in segments[1:])
+    split = ["-segment_times", times] if times else []
+    return [
+        "-i", input_path, "-map", "0:v:0", "-an", "-c:v", "copy",
+        "-f", "segment", "-segment_format", "mpegts", *split, pattern
+    ]
+
+
+async def _spliced_duration(pieces: List[str]) -> float:
+    """Total duration of the pieces as ffprobe reports them"""
+    infos = await asyncio.gather(*(media_probe.probe(piece) for piece in pieces))
+    return sum(info.duration if info else 0.0 for info in infos)
+
+
+async def _encode_segments(input_path: str, output_path: str, overlay_path: str, style: WatermarkStyle,
+                           settings: EncodingSettings, segments: List[Segment], scale: Optional[str] = None,
+                           windows: Optional[List[Window]] = None, parallel: int = 1,
+                           source_args: Optional[List[str]] = None) -> bool:
+    """Build every segment (up to parallel ffmpeg processes at once) and join them without a full transcode.
+
+    Returns False without writing output_path if the pieces don't add up to
+    the source duration, so the caller can fall back to a full encode.
+    """
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(os.path.abspath(output_path)))
+    semaphore = asyncio.Semaphore(parallel)
+    duration = segments[-1][1]
+
+    async def build(index: int, segment: Segment) -> str:
+        if not segment[2]:
+            return os.path.join(work_dir, f"source{index:04d}.ts")
+        piece = os.path.join(work_dir, f"{index:04d}.ts")
+        async with semaphore:
+            args = _segment_args(
+                input_path, overlay_path, style, settings, segment, piece, duration, scale, windows, source_args or []
+            )
+            if not await run_ffmpeg(args):
+                raise ValueError(f"ffmpeg failed on segment {segment[0]:.1f}-{segment[1]:.1f}s")
+        return piece
+
+    tasks = [asyncio.ensure_future(build(index, segment)) for index, segment in enumerate(segments)]
+    try:
+        if not all(encode for _, _, encode in segments):
+            # Copied pieces come from a single split of the whole video track
+            if not await run_ffmpeg(_split_args(input_path, segments, os.path.join(work_dir, "source%04d.ts"))):
+                return False
+            split = len([name for name in os.listdir(work_dir) if name.startswith("source")])
+            if split != len(segments):
+                logger.warning(f"{input_path} split into {split} pieces instead of {len(segments)}")
+                return False
+        pieces = await asyncio.gather(*tasks)
+
+        # A piece cut at the wrong keyframe repeats or drops a GOP and the video drifts from the copied audio
+        spliced = await _spliced_duration(pieces)
+        if abs(spliced - duration) > SPLICE_TOLERANCE:
+            logger.warning(f"Pieces of {input_path} add up to {spliced:.3f}s instead of {duration:.3f}s")
+            return False
+
+        list_path = os.path.join(work_dir, "pieces.txt")
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{piece}'\n" for piece in pieces)
+
+        # Audio was never cut, so it is copied from the original in one piece
+        ok = await run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_path, "-i", input_path,
+            "-map", "0:v", "-map", "1:a?", "-c", "copy", output_path
+        ])
+        return ok and os.path.exists(output_path)
+    finally:
+        # Stops (and kills the ffmpeg of) the other segments when one fails
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def watermark_video(input_path: str, output_path: str, text: str, style: WatermarkStyle = WatermarkStyle(),
+                          backlog: Optional[int] = None, workers: int = CORES,
+                          intro: float = 0, outro: float = 0) -> bool:
+    """Burn text into a video, copying the audio untouched.
+
+    Encoder settings come from encoding_policy; backlog is the number of
+    encodes running or queued, and defaults to those running in this process.
+    With intro/outro (seconds) only those parts are watermarked, and for
+    H.264 input only the GOPs they touch are re-encoded; if the duration
+    can't be probed the job fails rather than watermarking everything.
+    Long videos are cut at keyframes and the chunks encoded in parallel.
+    """
+    global _active_encodes
+    _active_encodes += 1
+    try:
+        overlay_path = await overlay_cache.path(text, style)
+        settings, info = await settings_for(input_path, backlog if backlog is not None else _active_encodes, workers)
+        scale = settings.scale_filter(info)
+        if (intro or outro) and not (info and info.duration):
+            # Without a duration the outro can't be placed; don't quietly watermark the whole video instead
+            raise ValueError("the video's duration is unknown, so the intro/outro can't be placed")
+        windows = branding_windows(info.duration, intro, outro) if info else None
+
+        if windows and info.codec == "h264" and not scale:
+            source_args = source_match_args(info)
+            if source_args is None:
+                logger.warning(
+                    f"libx264 can't match {info.profile or 'unknown'} {info.pix_fmt or 'unknown'} video; "
+                    f"re-encoding {input_path} in full"
+                )
+            else:
+                keyframes = await keyframe_times(input_path, [point for window in windows for point in window])
+                if not keyframes:
+                    logger.warning(f"No keyframes found near the intro/outro of {input_path}; re-encoding it in full")
+                segments = plan_segments(windows, keyframes, info.duration)
+                copied = sum(end - start for start, end, encode in segments if not encode)
+                if copied > 0:
+                    logger.info(f"Re-encoding {info.duration - copied:.1f}s of {info.duration:.1f}s, copying the rest")
+                    if await _encode_segments(
+                        input_path, output_path, overlay_path, style, settings, segments,
+                        windows=windows, source_args=source_args
+                    ):
+                        return True
+                    logger.warning(f"Splicing failed for {input_path}; encoding it in full")
+        elif not windows and info and info.duration >= PARALLEL_MIN_DURATION:
+            # Long video: encode GOP-aligned chunks side by side, splitting this encode's threads between them
+            parallel = min(settings.threads, int(info.duration // MIN_CHUNK_DURATION))
+            if parallel >= 2:
+                cuts = [info.duration * i / parallel for i in range(1, parallel)]
+                segments = plan_chunks(cuts, await keyframe_times(input_path, cuts), info.duration)
+                if len(segments) >= 2:
+                    logger.info(f"Encoding {info.duration:.0f}s video as {len(segments)} parallel chunks")
+                    chunk_settings = settings._replace(threads=max(1, settings.threads // len(segments)))
+                    if await _encode_segments(
+                        input_path, output_path, overlay_path, style, chunk_settings, segments,
+                        scale=scale, parallel=len(segments)
+                    ):
+                        return True
+                    logger.warning(f"Splicing failed for {input_path}; encoding it in full")
+
+        ok = await run_ffmpeg([
+            "-i", input_path,
+            "-i", overlay_path,
+            "-filter_complex", overlay_filter(style, scale, windows) + "[v]",
+            "-map", "[v]", "-map", "0:a?",
+            "-c:v", VIDEO_CODEC, "-preset", settings.preset, "-crf", str(settings.crf),
+            "-threads", str(settings.threads),
+            "-c:a", "copy",
+            output_path
+        ])
+        return ok and os.path.exists(output_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to watermark {input_path}: {str(e)}")
+        return False
+    finally:
+        _active_encodes -= 1
+
+
+async def watermark_image(input_path: str, output_path: str, text: str, style: WatermarkStyle = WatermarkStyle()) -> bool:
+    """Burn text into an image"""
+    try:
+        overlay_path = await overlay_cache.path(text, style)
+        ok = await run_ffmpeg(["-i", input_path, "-i", overlay_path, "-filter_complex", overlay_filter(style), output_path])
+        return ok and os.path.exists(output_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to watermark {input_path}: {str(e)}")
+        return False
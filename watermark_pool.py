@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+from job_queue import FairScheduler, PER_USER_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (override through environment variables)
+WORKERS = int(os.getenv("WATERMARK_WORKERS", os.cpu_count() or 1))  # Encodes running at once
+MAX_QUEUED = int(os.getenv("WATERMARK_MAX_QUEUED", WORKERS * 4))  # Jobs allowed to wait for a worker
+
+
+class WatermarkError(Exception):
+    """Raised when a watermark job cannot be run"""
+    pass
+
+
+class PoolBusy(WatermarkError):
+    """Raised when too many watermark jobs are already waiting"""
+    pass
+
+
+class JobCancelled(WatermarkError):
+    """Raised when a watermark job was cancelled by its owner"""
+    pass
+
+
+class WatermarkPool:
+    """Limits how many watermark encodes run at once.
+
+    Workers are handed out round-robin between users like download slots.
+    Jobs are coroutine functions whose work runs in a subprocess (ffmpeg),
+    so cancelling a job stops that encode instead of leaving it to finish
+    in the background.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_queued: int = MAX_QUEUED, per_user: int = PER_USER_JOBS):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._slots = FairScheduler(workers, per_user)
+        self._jobs: Dict[Hashable, asyncio.Task] = {}
+        self._cancelled: Set[asyncio.Task] = set()
+
+    @property
+    def active(self) -> int:
+        return self._slots.active
+
+    @property
+    def queued(self) -> int:
+        return self._slots.queued
+
+    @property
+    def backlog(self) -> int:
+        """Jobs running or waiting for a worker"""
+        return self._slots.active + self._slots.queued
+
+    async def _execute(self, user_id: Hashable, func: Callable[..., Awaitable], args: tuple) -> Any:
+        async with self._slots.slot(user_id):
+            return await func(*args)
+
+    async def run(self, user_id: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        """Await func(*args) in a worker slot and return its result.
+
+        Raises PoolBusy when the queue is full and JobCancelled when
+        cancel(user_id) is called while the job waits or runs.
+        """
+        if self._slots.queued >= self.max_queued:
+            raise PoolBusy(f"{self._slots.queued} watermark jobs are already waiting")
+
+        job = asyncio.ensure_future(self._execute(user_id, func, args))
+        self._jobs[user_id] = job
+        try:
+            return await job
+        except asyncio.CancelledError:
+            if job in self._cancelled:
+                raise JobCancelled("Watermark job cancelled")
+            raise
+        finally:
+            self._cancelled.discard(job)
+            if self._jobs.get(user_id) is job:
+                del self._jobs[user_id]
+
+    def cancel(self, user_id: Hashable) -> bool:
+        """Cancel the newest job of user_id; return False if there is none"""
+        job = self._jobs.get(user_id)
+        if job is None or job.done():
+            return False
+        logger.info(f"Cancelling watermark job of user {user_id}")
+        self._cancelled.add(job)
+        job.cancel()
+        return True